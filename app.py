@@ -4,7 +4,16 @@ import uuid
 import logging
 from functools import wraps
 from flask_cors import CORS
-from flask import Flask, request, jsonify, send_file, render_template_string
+from flask import (
+    Flask,
+    g,
+    request,
+    jsonify,
+    send_file,
+    redirect,
+    Response,
+    render_template_string,
+)
 from flask_mail import Mail
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
@@ -15,22 +24,42 @@ import database
 import auth
 import pages
 import tools
+import preflight
+import preview
+import state
 
 # ---------------- App setup ----------------
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
 app = Flask(__name__)
 CORS(app)
-limiter = Limiter(get_remote_address, app=app, default_limits=["10 per minute"])
+app.config["RATELIMIT_ENABLED"] = (
+    os.getenv("RATELIMIT_ENABLED", "true").lower() != "false"
+)
+# Counters live in the shared state store so limits hold across workers
+limiter = Limiter(
+    get_remote_address,
+    app=app,
+    default_limits=["10 per minute"],
+    storage_uri="sharedstate://",
+)
+# Runs due expiry jobs (unverified users, stored conversions) for all workers.
+# Not in text-extraction pool processes: spawn re-runs `python app.py` there
+# as __mp_main__.
+if __name__ != "__mp_main__":
+    state.start_scheduler()
 
 # Mail config
 app.config["MAIL_SERVER"] = os.getenv("MAIL_SERVER")
 app.config["MAIL_PORT"] = int(os.getenv("MAIL_PORT"))
-app.config["MAIL_USE_TLS"] = True
+app.config["MAIL_USE_TLS"] = os.getenv("MAIL_USE_TLS", "true").lower() != "false"
 app.config["MAIL_USERNAME"] = os.getenv("MAIL_USERNAME")
 app.config["MAIL_PASSWORD"] = os.getenv("MAIL_PASSWORD")
 
 mail = Mail(app)
+
+# Let a fronting proxy (nginx X-Accel / Apache) send local results
+app.config["USE_X_SENDFILE"] = os.getenv("USE_X_SENDFILE", "false").lower() == "true"
 SECRET_KEY = os.getenv("SECRET_KEY")
 
 
@@ -45,6 +74,7 @@ def require_auth(func):
         email = database.verify_jwt(token)
         if not email:
             return jsonify({"error": "Invalid or expired token"}), 403
+        g.email = email
         return func(*args, **kwargs)
 
     return wrapper
@@ -73,6 +103,26 @@ def build_response(conversion):
     }
 
 
+def optimize_error(optimize):
+    """Error message for an invalid optimize= value, None if it is valid"""
+    try:
+        tools.parse_optimize(optimize)
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+def keep_local_copy(conversion, file_path):
+    """Keep the result on disk so /download can serve it until evicted"""
+    if conversion and conversion.get("id"):
+        try:
+            tools.keep_result(file_path, conversion["id"])
+        except FileNotFoundError:
+            # Wiped by another request's clear_uploads_folder(); the result is
+            # already stored, /download falls back to its signed URL
+            logging.warning(f"[RESULTS] No local copy kept for {conversion['id']}")
+
+
 @app.route("/merge-pdf", methods=["POST"])
 @require_auth
 def merge_pdf_route():
@@ -81,8 +131,12 @@ def merge_pdf_route():
         pdf_files = request.files.getlist("files")
         if not pdf_files:
             return jsonify({"error": "No files uploaded"}), 400
+        optimize = request.form.get("optimize")
+        error = optimize_error(optimize)
+        if error:
+            return jsonify({"error": error}), 400
         paths = tools.save_uploaded_files(pdf_files)
-        output_path = tools.merge_pdfs(paths)
+        output_path = tools.merge_pdfs(paths, optimize=optimize)
         filename = pdf_files[0].filename
         converted_filename = f"{filename}_merged.pdf"
 
@@ -94,6 +148,7 @@ def merge_pdf_route():
             file_path=output_path,
         )
 
+        keep_local_copy(conversion, output_path)
         tools.clear_uploads_folder()
         return jsonify(build_response(conversion))
 
@@ -112,8 +167,12 @@ def split_pdf_route():
         split_value = request.form.get("splitValue")
         if not pdf_file:
             return jsonify({"error": "No file uploaded"}), 400
+        optimize = request.form.get("optimize")
+        error = optimize_error(optimize)
+        if error:
+            return jsonify({"error": error}), 400
         path = tools.save_uploaded_files([pdf_file])[0]
-        zip_path = tools.split_pdf(path, split_type, split_value)
+        zip_path = tools.split_pdf(path, split_type, split_value, optimize=optimize)
         converted_filename = pdf_file.filename.replace(".pdf", "_split.zip")
 
         conversion = database.add_conversion(
@@ -124,6 +183,7 @@ def split_pdf_route():
             file_path=zip_path,
         )
 
+        keep_local_copy(conversion, zip_path)
         tools.clear_uploads_folder()
         return jsonify(build_response(conversion))
 
@@ -141,8 +201,14 @@ def compress_pdf_route():
         compression_level = request.form.get("compressionLevel", "medium")
         if not pdf_file:
             return jsonify({"error": "No file uploaded"}), 400
+        optimize = request.form.get("optimize")
+        error = optimize_error(optimize)
+        if error:
+            return jsonify({"error": error}), 400
         path = tools.save_uploaded_files([pdf_file])[0]
-        output_path = tools.compress_pdf(path, level=compression_level)
+        output_path = tools.compress_pdf(
+            path, level=compression_level, optimize=optimize
+        )
         converted_filename = pdf_file.filename.replace(".pdf", "_compressed.pdf")
 
         conversion = database.add_conversion(
@@ -156,9 +222,15 @@ def compress_pdf_route():
         if not conversion:
             return jsonify({"error": "Failed to save conversion"}), 500
 
+        keep_local_copy(conversion, output_path)
         tools.clear_uploads_folder()
         return jsonify(build_response(conversion))
 
+    except tools.MemoryLimitError as e:
+        logging.error(f"[MEMORY] compress_pdf_route: {e}")
+        tools.clear_uploads_folder()
+        return jsonify({"error": str(e)}), 503
+
     except Exception as e:
         logging.error(f"[ERROR] compress_pdf_route: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
@@ -184,6 +256,7 @@ def pdf_to_word_route():
             file_path=output_path,
         )
 
+        keep_local_copy(conversion, output_path)
         tools.clear_uploads_folder()
         return jsonify(build_response(conversion))
 
@@ -212,9 +285,15 @@ def pdf_to_jpg_route():
             file_path=zip_path,
         )
 
+        keep_local_copy(conversion, zip_path)
         tools.clear_uploads_folder()
         return jsonify(build_response(conversion))
 
+    except tools.MemoryLimitError as e:
+        logging.error(f"[MEMORY] pdf_to_jpg_route: {e}")
+        tools.clear_uploads_folder()
+        return jsonify({"error": str(e)}), 503
+
     except Exception as e:
         logging.error(f"[ERROR] pdf_to_jpg_route: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
@@ -231,6 +310,10 @@ def edit_route():
 
         if not pdf_file:
             return jsonify({"error": "No file uploaded"}), 400
+        optimize = request.form.get("optimize")
+        error = optimize_error(optimize)
+        if error:
+            return jsonify({"error": error}), 400
         path = tools.save_uploaded_files([pdf_file])[0]
 
         edit_data = json.loads(edit_data)
@@ -248,7 +331,7 @@ def edit_route():
         x = edit_data.get("x")
         y = edit_data.get("y")
 
-        output_path = tools.edit_pdf(path, edit_type, content, x, y)
+        output_path = tools.edit_pdf(path, edit_type, content, x, y, optimize=optimize)
         converted_filename = pdf_file.filename.replace(".pdf", "_edited.pdf")
 
         conversion = database.add_conversion(
@@ -259,6 +342,7 @@ def edit_route():
             file_path=output_path,
         )
 
+        keep_local_copy(conversion, output_path)
         tools.clear_uploads_folder()
         return jsonify(build_response(conversion))
 
@@ -267,12 +351,129 @@ def edit_route():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/pdf-to-text", methods=["POST"])
+@require_auth
+def pdf_to_text_route():
+    """Stream the text of a PDF as NDJSON, one line per page"""
+    path = None
+    try:
+        pdf_file = request.files.get("file")
+        mode = request.form.get("mode", "plain")
+        if not pdf_file:
+            return jsonify({"error": "No file uploaded"}), 400
+        if mode not in tools.TEXT_MODES:
+            modes = ", ".join(tools.TEXT_MODES)
+            return jsonify({"error": f"Invalid mode, must be one of {modes}"}), 400
+        path = tools.save_uploaded_files([pdf_file], folder=tools.STREAM_FOLDER)[0]
+        page_count = tools.count_pages(path)
+    except Exception as e:
+        logging.error(f"[ERROR] pdf_to_text_route: {e}", exc_info=True)
+        if path and os.path.exists(path):
+            os.remove(path)
+        return jsonify({"error": str(e)}), 500
+
+    def generate():
+        try:
+            for page in tools.extract_text_pages(path, mode):
+                yield json.dumps(page) + "\n"
+        except Exception as e:
+            logging.error(f"[ERROR] pdf_to_text_route: {e}", exc_info=True)
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    def cleanup():
+        if os.path.exists(path):
+            os.remove(path)
+
+    response = Response(
+        generate(),
+        mimetype="application/x-ndjson",
+        headers={"X-Page-Count": str(page_count), "X-Accel-Buffering": "no"},
+    )
+    # Runs when the server closes the response, even if it was never iterated
+    response.call_on_close(cleanup)
+    return response
+
+
+@app.route("/preview", methods=["POST"])
+@require_auth
+def preview_upload():
+    """Store a PDF for previews, returns its document hash and page count"""
+    try:
+        pdf_file = request.files.get("file")
+        if not pdf_file:
+            return jsonify({"error": "No file uploaded"}), 400
+        doc_hash, page_count = preview.store_document(pdf_file)
+        return jsonify({"document": doc_hash, "pages": page_count})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"[ERROR] preview_upload: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/preview/<doc_hash>/<int:page>")
+@limiter.limit(os.getenv("PREVIEW_RATE_LIMIT", "600 per minute"))
+@require_auth
+def preview_page(doc_hash, page):
+    """Rendered page image, cached and ETag-validated"""
+    try:
+        fmt = request.args.get("format", "webp").lower()
+        if fmt not in preview.FORMATS:
+            formats = ", ".join(preview.FORMATS)
+            return jsonify({"error": f"Invalid format, must be one of {formats}"}), 400
+        width = preview.clamp_width(request.args.get("width", preview.DEFAULT_WIDTH, type=int))
+
+        # Same document hash + page + size always renders the same image
+        etag = preview.cache_key(doc_hash, page, width, fmt)
+        if etag in request.if_none_match:
+            return Response(status=304, headers={"ETag": f'"{etag}"'})
+
+        data = preview.get_preview(doc_hash, page, width, fmt)
+        if data is None:
+            return jsonify({"error": "Document not found, upload it again"}), 404
+
+        response = Response(data, mimetype=preview.FORMATS[fmt])
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, max-age=86400, immutable"
+        return response
+    except IndexError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        logging.error(f"[ERROR] preview_page: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/inspect", methods=["POST"])
+@require_auth
+def inspect_route():
+    """Describe a PDF and predict time / output size for every operation"""
+    path = None
+    try:
+        pdf_file = request.files.get("file")
+        if not pdf_file:
+            return jsonify({"error": "No file uploaded"}), 400
+        path = tools.save_uploaded_files([pdf_file], folder=tools.STREAM_FOLDER)[0]
+        stats = preflight.inspect_pdf(path)
+        return jsonify({"document": stats, "estimates": preflight.estimate_all(stats)})
+
+    except Exception as e:
+        logging.error(f"[ERROR] inspect_route: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
 @app.route("/conversions")
 @require_auth
 def conversions():
     try:
         user_id = get_user_id()
-        conversions = database.get_conversions(user_id)
+        limit = request.args.get("limit", type=int)
+        offset = request.args.get("offset", 0, type=int)
+        if (limit is not None and limit < 0) or offset < 0:
+            return jsonify({"error": "limit and offset must not be negative"}), 400
+        conversions = database.get_conversions(user_id, limit=limit, offset=offset)
         if conversions is None:  # actual error
             return {"error": "Failed to fetch conversions"}, 500
         # empty list is fine
@@ -282,6 +483,58 @@ def conversions():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/download/<conversion_id>")
+@require_auth
+def download(conversion_id):
+    """
+    Stream a result still held on this server (Range / ETag aware),
+    otherwise redirect to the storage signed URL.
+    """
+    try:
+        user_id = get_user_id()
+        # X-User-ID is client supplied: it must be the token holder's account
+        user = database.get_user_by_email(g.email)
+        if not user or str(user["id"]) != str(user_id):
+            return jsonify({"error": "Conversion not found"}), 404
+        conversion = database.get_conversion(conversion_id, user_id)
+        if not conversion:
+            return jsonify({"error": "Conversion not found"}), 404
+
+        path = tools.get_result_path(conversion_id)
+        if path:
+            try:
+                return send_file(
+                    path,
+                    as_attachment=True,
+                    download_name=conversion["converted_filename"],
+                    conditional=True,
+                    etag=True,
+                )
+            except FileNotFoundError:
+                pass  # evicted between lookup and open
+
+        if conversion.get("download_url"):
+            return redirect(conversion["download_url"], code=302)
+        return jsonify({"error": "File no longer available"}), 410
+    except Exception as e:
+        logging.error(f"[ERROR] download: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/conversions/<conversion_id>")
+@require_auth
+def conversion(conversion_id):
+    try:
+        user_id = get_user_id()
+        conversion = database.get_conversion(conversion_id, user_id)
+        if not conversion:
+            return jsonify({"error": "Conversion not found"}), 404
+        return {"data": conversion}, 200
+    except Exception as e:
+        logging.error(f"[ERROR] conversion: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
 # ---------------- Auth routes ----------------
 @app.route("/signup", methods=["POST"])
 def sign_up():
@@ -0,0 +1,256 @@
+# bench.py
+"""
+Benchmarks for the PDF tools on synthetic documents.
+
+    python bench.py                 # peak memory vs page count
+    python bench.py --pages 10 100 300
+    python bench.py --calibrate     # fit preflight's cost model
+    python bench.py --optimize      # output size / first-page latency per optimize mode
+"""
+import os
+import re
+import json
+import time
+import resource
+import argparse
+import multiprocessing
+import fitz  # PyMuPDF
+
+BENCH_FOLDER = "bench_corpus"
+
+
+# ---------------- Synthetic corpus ----------------
+def make_scan_pdf(pages, path=None, dpi=150):
+    """Build a scan-like PDF: every page is one full-page image, no text layer"""
+    path = path or os.path.join(BENCH_FOLDER, f"scan_{pages}p_{dpi}dpi.pdf")
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    doc = fitz.open()
+    width, height = int(8.27 * dpi), int(11.69 * dpi)
+    background = bytes((240, 240, 235)) * width
+    for i in range(pages):
+        page = doc.new_page(width=595, height=842)
+        # Grey "text line" stripes; built as raw samples, set_rect is slow per call
+        rows = []
+        for y in range(height):
+            if y % 40 < 12:
+                shade = bytes(((i * 7 + y - y % 40) % 200,) * 3)
+                rows.append(background[:180] + shade * (width - 120) + background[:180])
+            else:
+                rows.append(background)
+        pix = fitz.Pixmap(fitz.csRGB, width, height, b"".join(rows), False)
+        page.insert_image(page.rect, pixmap=pix)
+        pix = None
+    doc.save(path, deflate=True)
+    doc.close()
+    return path
+
+
+def make_text_pdf(pages, path=None):
+    """Build a text-only PDF with a few paragraphs per page"""
+    path = path or os.path.join(BENCH_FOLDER, f"text_{pages}p.pdf")
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    doc = fitz.open()
+    line = "The quick brown fox jumps over the lazy dog. " * 2
+    for i in range(pages):
+        page = doc.new_page(width=595, height=842)
+        for j in range(40):
+            page.insert_text((50, 60 + j * 18), f"{i + 1}.{j + 1} {line}", fontsize=9)
+    doc.save(path, deflate=True)
+    doc.close()
+    return path
+
+
+# ---------------- Runner ----------------
+def peak_rss_mb():
+    """
+    Peak RSS of this process in MB. VmHWM is reset on exec, unlike ru_maxrss
+    which a child inherits from the process that started it.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_op(op, path, queue):
+    import tools
+
+    start = time.perf_counter()
+    error = None
+    try:
+        if op == "compress_pdf":
+            tools.compress_pdf(path, level="low")
+        elif op == "pdf_to_jpg":
+            tools.pdf_to_jpg(path, scale=2.0)
+    except tools.MemoryLimitError as e:
+        error = str(e)
+    elapsed = time.perf_counter() - start
+    queue.put({"seconds": elapsed, "peak_mb": peak_rss_mb(), "error": error})
+
+
+def run_isolated(op, path):
+    """Run one operation in a fresh process so that its peak RSS is its own"""
+    ctx = multiprocessing.get_context("spawn")  # fresh interpreter, fresh VmHWM
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run_op, args=(op, path, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def bench_memory(page_counts):
+    print(f"{'operation':<14}{'pages':>7}{'seconds':>10}{'peak MB':>10}")
+    for op in ["compress_pdf", "pdf_to_jpg"]:
+        for pages in page_counts:
+            path = make_scan_pdf(pages)
+            result = run_isolated(op, path)
+            line = f"{op:<14}{pages:>7}{result['seconds']:>10.2f}{result['peak_mb']:>10.1f}"
+            if result["error"]:
+                line += f"  ({result['error']})"
+            print(line)
+
+
+# ---------------- Cost model calibration ----------------
+def run_operation(operation, path):
+    """Run one preflight operation and return its output path"""
+    import tools
+
+    if operation == "merge":
+        return tools.merge_pdfs([path])
+    if operation == "split":
+        return tools.split_pdf(path, "pages", "1")
+    if operation.startswith("compress_"):
+        return tools.compress_pdf(path, level=operation.split("_", 1)[1])
+    if operation == "pdf_to_word":
+        return tools.pdf_to_word(path)
+    if operation == "pdf_to_jpg":
+        return tools.pdf_to_jpg(path)
+    raise ValueError(f"Unknown operation {operation}")
+
+
+def fit_non_negative(x, y):
+    """
+    Least squares with coefficients >= 0: refit without the columns that
+    came out negative until none do (costs never go down with more input).
+    """
+    import numpy as np
+
+    active = list(range(x.shape[1]))
+    while True:
+        solution = np.linalg.lstsq(x[:, active], y, rcond=None)[0]
+        negative = [col for col, c in zip(active, solution) if c < 0]
+        if not negative:
+            break
+        active = [col for col in active if col not in negative]
+    coefficients = [0.0] * x.shape[1]
+    for col, c in zip(active, solution):
+        coefficients[col] = float(c)
+    return coefficients
+
+
+def calibrate(page_counts, output_path):
+    """
+    Time every operation on text and scan documents of each size and fit
+    preflight's linear model (least squares) for seconds and output size.
+    """
+    import logging
+    import numpy as np
+    import preflight
+    import tools
+
+    logging.disable(logging.INFO)  # pdf2docx logs every page
+    corpus = []
+    for pages in page_counts:
+        corpus += [make_text_pdf(pages), make_scan_pdf(pages, dpi=100), make_scan_pdf(pages)]
+
+    model = {}
+    for operation in preflight.OPERATIONS:
+        rows, seconds, sizes = [], [], []
+        for path in corpus:
+            stats = preflight.inspect_pdf(path)
+            start = time.perf_counter()
+            result = run_operation(operation, path)
+            seconds.append(time.perf_counter() - start)
+            sizes.append(os.path.getsize(result))
+            rows.append(preflight.features(stats))
+            tools.clear_uploads_folder()
+        x = np.array(rows)
+        model[operation] = {
+            "seconds": [round(c, 6) for c in fit_non_negative(x, seconds)],
+            "output_size": [round(c, 1) for c in fit_non_negative(x, sizes)],
+        }
+        print(f"{operation:<16}{model[operation]}")
+
+    with open(output_path, "w") as f:
+        json.dump(model, f, indent=2)
+    print(f"Cost model written to {output_path}")
+
+
+# ---------------- Output optimization ----------------
+def first_page_bytes(path):
+    """
+    Bytes a viewer must download before it can render page 1: the end of
+    the first-page section (/E) for a linearized file, else the whole file.
+    """
+    with open(path, "rb") as f:
+        head = f.read(1024)
+    match = re.search(rb"/Linearized\b.*?/E\s+(\d+)", head, re.S)
+    return int(match.group(1)) if match else os.path.getsize(path)
+
+
+def first_page_latency(path, bandwidth_mbps):
+    """Download time of first_page_bytes at bandwidth_mbps plus page 1 render time"""
+    download = first_page_bytes(path) * 8 / (bandwidth_mbps * 1e6)
+    start = time.perf_counter()
+    doc = fitz.open(path)
+    doc[0].get_pixmap()
+    doc.close()
+    return download + time.perf_counter() - start
+
+
+def bench_optimize(page_counts, bandwidth_mbps):
+    """Size and first-page latency of merged documents for each optimize mode"""
+    import tools
+
+    modes = ["none", "garbage", "web", "compact"]
+    print(f"first-page latency simulated at {bandwidth_mbps} Mbit/s")
+    print(f"{'document':<24}{'optimize':<10}{'size KB':>10}{'page 1 KB':>11}{'page 1 ms':>11}")
+    for pages in page_counts:
+        inputs = [make_text_pdf(pages), make_scan_pdf(pages)]
+        for mode in modes:
+            path = tools.merge_pdfs(inputs, optimize=mode)
+            size = os.path.getsize(path) / 1024
+            first = first_page_bytes(path) / 1024
+            latency = first_page_latency(path, bandwidth_mbps) * 1000
+            name = f"merge text+scan {pages}p"
+            print(f"{name:<24}{mode:<10}{size:>10.0f}{first:>11.0f}{latency:>11.0f}")
+        tools.clear_uploads_folder()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, nargs="+", default=None)
+    parser.add_argument("--calibrate", action="store_true")
+    parser.add_argument("--optimize", action="store_true")
+    parser.add_argument("--bandwidth", type=float, default=10, help="Mbit/s for --optimize")
+    args = parser.parse_args()
+    if args.optimize:
+        bench_optimize(args.pages or [10, 50, 150], args.bandwidth)
+    elif args.calibrate:
+        import preflight
+
+        calibrate(args.pages or [2, 8, 20], preflight.COST_MODEL_PATH)
+    else:
+        bench_memory(args.pages or [10, 50, 150, 300])
+    import tools
+
+    tools.clear_uploads_folder()
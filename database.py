@@ -1,15 +1,18 @@
 # database.py
 import os
 import jwt
+import asyncio
 import datetime
-from supabase import create_client
 from jwt import ExpiredSignatureError, InvalidTokenError
 from dotenv import load_dotenv
 import bcrypt
-import threading
+import json
 import logging
+import time
 import uuid
 import httpx
+import state
+from supabase_http import SupabaseClient, SupabaseError, FileStream, run
 
 # Configure logging at the start of your app
 logging.basicConfig(level=logging.INFO)
@@ -20,16 +23,21 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 SECRET_KEY = os.getenv("SECRET_KEY")
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+STORAGE_BUCKET = "converted_files"
+SIGNED_URL_TTL = 60 * 60  # seconds
+SIGNED_URL_REFRESH_MARGIN = 5 * 60  # re-sign when less than this is left
+CONVERSION_TTL = 60 * 60  # seconds before a stored conversion is deleted
+
+supabase = SupabaseClient(SUPABASE_URL, SUPABASE_KEY)
 
 
 # ---------------- Auth helpers ----------------
 def get_user_by_email(email):
     """Check if a user exists in DB by email"""
     try:
-        response = supabase.table("users").select("*").eq("email", email).execute()
-        if response.data and len(response.data) > 0:
-            return response.data[0]
+        users = run(supabase.select("users", {"email": email}))
+        if users:
+            return users[0]
         return None
     except Exception as e:
         logging.error(f"[DB ERROR] get_user_by_email: {e}", exc_info=True)
@@ -40,21 +48,20 @@ def add_user(full_name, email, password):
     """Insert a new user into DB with hashed password"""
     try:
         hashed_password = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
-        response = (
-            supabase.table("users")
-            .insert(
+        users = run(
+            supabase.insert(
+                "users",
                 {
                     "fullname": full_name,
                     "email": email,
                     "password": hashed_password,
                     "is_verified": False,
-                }
+                },
             )
-            .execute()
         )
-        logging.info(f"[DB] User added: {response}")
-        if response.data:
-            return response.data[0]
+        logging.info(f"[DB] User added: {email}")
+        if users:
+            return users[0]
         return None
     except Exception as e:
         logging.error(f"[DB ERROR] add_user: {e}", exc_info=True)
@@ -64,9 +71,7 @@ def add_user(full_name, email, password):
 def mark_verified(email):
     """Set user.is_verified=True"""
     try:
-        supabase.table("users").update({"is_verified": True}).eq(
-            "email", email
-        ).execute()
+        run(supabase.update("users", {"is_verified": True}, {"email": email}))
         logging.info(f"[DB] User verified: {email}")
         return True
     except Exception as e:
@@ -77,8 +82,8 @@ def mark_verified(email):
 def delete_user(email):
     """Delete a user from DB"""
     try:
-        response = supabase.table("users").delete().eq("email", email).execute()
-        if response.data and len(response.data) > 0:
+        deleted = run(supabase.delete("users", {"email": email}))
+        if deleted:
             logging.info(f"[DB] User deleted: {email}")
             return {"success": True, "message": f"User {email} deleted"}
         else:
@@ -114,15 +119,50 @@ def verify_jwt(token):
 
 def schedule_unverified_deletion(email, delay_seconds=3600):
     """Delete user if not verified after delay_seconds (default 1 hour)"""
+    state.schedule(
+        "delete_unverified", {"email": email}, delay_seconds, job_id=f"unverified:{email}"
+    )
+
+
+def delete_if_unverified(payload):
+    email = payload["email"]
+    user = get_user_by_email(email)
+    if user and not user.get("is_verified", False):
+        logging.info(f"[INFO] Deleting unverified user: {email}")
+        delete_user(email)
+
+
+async def remove_conversion(storage_path, file_id, return_exceptions=False):
+    """Delete a conversion's storage object and DB record concurrently"""
+    return await asyncio.gather(
+        supabase.remove(STORAGE_BUCKET, [storage_path]),
+        supabase.delete("files", {"id": file_id}),
+        return_exceptions=return_exceptions,
+    )
+
 
-    def delete_if_unverified():
-        user = get_user_by_email(email)
-        if user and not user.get("is_verified", False):
-            logging.info(f"[INFO] Deleting unverified user: {email}")
-            delete_user(email)
+def delete_conversion(payload):
+    """Remove a stored conversion and its DB record"""
+    storage_path, file_id = payload["storage_path"], payload["file_id"]
+    run(remove_conversion(storage_path, file_id))
+    state.get_state().delete(f"signed:{storage_path}")
+    logging.info(f"[CLEANUP] Deleted {storage_path} and DB record {file_id}")
 
-    timer = threading.Timer(delay_seconds, delete_if_unverified)
-    timer.start()
+
+state.register_job("delete_unverified", delete_if_unverified)
+state.register_job("delete_conversion", delete_conversion)
+
+
+def storage_file_info(conversion_type):
+    """Storage extension and content type for a conversion type"""
+    if conversion_type in ["split", "pdf_to_jpg"]:
+        return ".zip", "application/zip"
+    elif conversion_type == "pdf_to_word":
+        return (
+            ".docx",
+            "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        )
+    return ".pdf", "application/pdf"
 
 
 def add_conversion(
@@ -139,108 +179,216 @@ def add_conversion(
     """
     try:
         logging.info("[START] add_conversion called")
-
-        # 1️⃣ Insert DB record first to get UUID
-        created_at = datetime.datetime.utcnow().isoformat()
-        file_size = os.path.getsize(file_path)
-
-        insert_resp = (
-            supabase.table("files")
-            .insert(
-                {
-                    "user_id": user_id,
-                    "original_filename": original_filename,
-                    "converted_filename": converted_filename,
-                    "conversion_type": conversion_type,
-                    "status": status,
-                    "created_at": created_at,
-                    "completed_at": created_at if status == "completed" else None,
-                    "file_size": file_size,
-                    "download_url": None,  # placeholder until upload
-                }
+        return run(
+            _add_conversion(
+                user_id,
+                original_filename,
+                converted_filename,
+                conversion_type,
+                file_path,
+                status,
             )
-            .execute()
         )
+    except httpx.TimeoutException:
+        logging.error("[TIMEOUT] Upload took too long")
+        return {"error": "upload_timeout"}
 
-        if not insert_resp.data:
-            logging.error("[DB ERROR] Could not insert file record")
-            return None
+    except Exception as e:
+        logging.error(f"[DB ERROR] add_conversion: {e}", exc_info=True)
+        return None
 
-        file_record = insert_resp.data[0]
-        file_id = file_record["id"]  # UUID from Supabase
 
-        # 2️⃣ Decide file extension based on conversion type
-        if conversion_type in ["split", "pdf_to_jpg"]:
-            file_ext = ".zip"
-            content_type = "application/zip"
-        elif conversion_type == "pdf_to_word":
-            file_ext = ".docx"
-            content_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document" 
-        else:
-            file_ext = ".pdf"
-            content_type = "application/pdf"
+async def _add_conversion(
+    user_id, original_filename, converted_filename, conversion_type, file_path, status
+):
+    # 1️⃣ Generate the UUID here so the DB insert and the upload can overlap
+    file_id = str(uuid.uuid4())
+    created_at = datetime.datetime.utcnow().isoformat()
+    file_size = os.path.getsize(file_path)
+    file_ext, content_type = storage_file_info(conversion_type)
+    storage_path = f"{user_id}/{file_id}{file_ext}"
+
+    # Schedule deletion after 1 hour before anything is written, so that
+    # neither half can be orphaned (runs on whichever worker is up then)
+    await asyncio.to_thread(
+        state.schedule,
+        "delete_conversion",
+        {"storage_path": storage_path, "file_id": file_id},
+        CONVERSION_TTL,
+        f"conversion:{file_id}",
+    )
+
+    # 2️⃣ Insert DB record and upload file concurrently
+    inserted, uploaded = await asyncio.gather(
+        supabase.insert(
+            "files",
+            {
+                "id": file_id,
+                "user_id": user_id,
+                "original_filename": original_filename,
+                "converted_filename": converted_filename,
+                "conversion_type": conversion_type,
+                "status": status,
+                "created_at": created_at,
+                "completed_at": created_at if status == "completed" else None,
+                "file_size": file_size,
+                "download_url": None,  # placeholder until upload
+            },
+        ),
+        supabase.upload(STORAGE_BUCKET, storage_path, FileStream(file_path), content_type),
+        return_exceptions=True,
+    )
+
+    # Undo both halves if either failed: a write that timed out may still
+    # have been applied. The scheduled deletion retries if this fails too.
+    if isinstance(uploaded, Exception) or isinstance(inserted, Exception) or not inserted:
+        await remove_conversion(storage_path, file_id, return_exceptions=True)
+        for result in (inserted, uploaded):
+            if isinstance(result, Exception):
+                raise result
+        logging.error("[DB ERROR] Could not insert file record")
+        return None
+    file_record = inserted[0]
 
-        # 3️⃣ Upload file using UUID as storage path
-        storage_path = f"{user_id}/{file_id}{file_ext}"
-        storage = supabase.storage.from_("converted_files")
+    # 3️⃣ Create signed URL (1 hour)
+    download_url = await supabase.create_signed_url(
+        STORAGE_BUCKET, storage_path, SIGNED_URL_TTL
+    )
+    await asyncio.to_thread(
+        cache_signed_urls, {storage_path: download_url}, time.time() + SIGNED_URL_TTL
+    )
 
-        with open(file_path, "rb") as f:
-            storage.upload(storage_path, f, {"content-type": content_type})
+    # 4️⃣ Update DB record with the signed URL
+    await supabase.update("files", {"download_url": download_url}, {"id": file_id})
 
-        # 4️⃣ Create signed URL (1 hour)
-        download_url = storage.create_signed_url(storage_path, 60 * 60)["signedURL"]
+    logging.info(f"[UPLOAD] File stored as {storage_path}, URL: {download_url}")
 
-        # 5️⃣ Update DB record with the signed URL
-        supabase.table("files").update({"download_url": download_url}).eq(
-            "id", file_id
-        ).execute()
+    return {**file_record, "download_url": download_url}
 
-        logging.info(f"[UPLOAD] File stored as {storage_path}, URL: {download_url}")
 
-        # 6️⃣ Schedule deletion after 1 hour
-        def delete_after_delay():
-            try:
-                storage.remove([storage_path])
-                logging.info(f"[CLEANUP] Deleted {storage_path} from storage")
-                supabase.table("files").delete().eq("id", file_id).execute()
-                logging.info(f"[CLEANUP] Deleted DB record for {file_id}")
-            except Exception as e:
-                logging.error(f"[CLEANUP ERROR] {e}", exc_info=True)
+# ---------------- Signed URLs ----------------
+def storage_path_for(conversion):
+    """Storage object path of a conversion record"""
+    file_ext, _ = storage_file_info(conversion["conversion_type"])
+    return f"{conversion['user_id']}/{conversion['id']}{file_ext}"
 
-        threading.Timer(3600, delete_after_delay).start()
 
-        return {**file_record, "download_url": download_url}
-    except httpx.ReadTimeout:
-        logging.error("[TIMEOUT] Upload took too long")
-        return {"error": "upload_timeout"}
+def cache_signed_urls(urls, expires_at):
+    """
+    Share {storage_path: signed_url} with every worker. Entries expire
+    from the store once they are within the refresh margin.
+    """
+    ttl = expires_at - SIGNED_URL_REFRESH_MARGIN - time.time()
+    if urls and ttl > 0:
+        state.get_state().set_many(
+            {
+                f"signed:{path}": json.dumps({"url": url, "expires_at": expires_at})
+                for path, url in urls.items()
+            },
+            ttl,
+        )
 
-    except Exception as e:
-        logging.error(f"[DB ERROR] add_conversion: {e}", exc_info=True)
-        return None
+
+def cached_signed_urls(storage_paths):
+    """{storage_path: (url, expires_at)} for paths with a usable cached URL"""
+    cached = state.get_state().get_many([f"signed:{path}" for path in storage_paths])
+    result = {}
+    for path in storage_paths:
+        raw = cached.get(f"signed:{path}")
+        if raw:
+            entry = json.loads(raw)
+            result[path] = (entry["url"], entry["expires_at"])
+    return result
 
 
-def get_conversions(user_id):
+async def refresh_download_urls(conversions):
     """
-    Fetch all conversions for a specific user.
+    Set a fresh download_url on each record. URLs are reused from the
+    shared cache (one batched read); the rest are signed in a single
+    batched call and written back in one batch. If signing fails the
+    stored download_url is kept (None if there is none), with no expiry.
+    """
+    now = time.time()
+    paths = [storage_path_for(conversion) for conversion in conversions]
+    cached = await asyncio.to_thread(cached_signed_urls, paths) if paths else {}
+    missing = []
+    for conversion, path in zip(conversions, paths):
+        if path in cached:
+            url, expires_at = cached[path]
+            conversion["download_url"] = url
+            conversion["download_url_expires_at"] = int(expires_at)
+        else:
+            missing.append((conversion, path))
+
+    if missing:
+        try:
+            signed = await supabase.create_signed_urls(
+                STORAGE_BUCKET, [path for _, path in missing], SIGNED_URL_TTL
+            )
+        except (SupabaseError, httpx.HTTPError) as e:
+            # Storage down: keep the URL stored with the record, expiry unknown
+            logging.warning(f"[STORAGE] Signing download URLs failed: {e}")
+            for conversion, _ in missing:
+                conversion.setdefault("download_url", None)
+                conversion["download_url_expires_at"] = None
+            return conversions
+        expires_at = now + SIGNED_URL_TTL
+        fresh = {}
+        for conversion, path in missing:
+            url = signed.get(path)
+            conversion["download_url"] = url  # None once the file is deleted
+            conversion["download_url_expires_at"] = int(expires_at) if url else None
+            if url:
+                fresh[path] = url
+        await asyncio.to_thread(cache_signed_urls, fresh, expires_at)
+    return conversions
+
+
+def get_conversions(user_id, limit=None, offset=0):
+    """
+    Fetch conversions for a specific user, newest first, optionally one
+    page (limit / offset) at a time. Download URLs are refreshed on read.
     Returns a list of conversion records (dicts).
     """
     try:
-        resp = (
-            supabase.table("files")
-            .select("*")
-            .eq("user_id", user_id)
-            .order("created_at", desc=True)  # newest first
-            .execute()
-        )
-        logging.error(resp)
-        # Check if there was an error
-        if getattr(resp, "error", None):
-            print(f"[ERROR] Supabase returned an error: {resp.error}")
-            return None  # Indicates request failed
 
-        # If no error, return data (could be empty list)
-        return resp.data or []  # empty list if no records
+        async def fetch():
+            conversions = await supabase.select(
+                "files",
+                {"user_id": user_id},
+                order="created_at",
+                desc=True,  # newest first
+                limit=limit,
+                offset=offset,
+            )
+            return await refresh_download_urls(conversions or [])
+
+        # Return data (could be empty list)
+        return run(fetch())
+
+    except SupabaseError as e:
+        print(f"[ERROR] Supabase returned an error: {e}")
+        return None  # Indicates request failed
 
     except Exception as e:
         print(f"[ERROR] get_conversions failed: {e}")
         return []
+
+
+def get_conversion(conversion_id, user_id):
+    """Fetch a single conversion record owned by user_id (fresh download URL), or None"""
+    try:
+
+        async def fetch():
+            conversions = await supabase.select(
+                "files", {"id": conversion_id, "user_id": user_id}
+            )
+            return await refresh_download_urls(conversions)
+
+        conversions = run(fetch())
+        if conversions:
+            return conversions[0]
+        return None
+    except Exception as e:
+        logging.error(f"[DB ERROR] get_conversion: {e}", exc_info=True)
+        return None
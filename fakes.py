@@ -0,0 +1,452 @@
+# fakes.py
+"""
+In-process stand-ins for Supabase (PostgREST + Storage), SMTP and Redis.
+
+All servers run on background threads, bind to 127.0.0.1 on a free port,
+and can add latency and inject errors. They implement only what
+database.py / supabase_http.py, flask_mail and state.py actually use.
+"""
+import json
+import time
+import fnmatch
+import uuid
+import random
+import threading
+import socketserver
+from urllib.parse import urlsplit, parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Faults:
+    """Latency (seconds, +/- jitter) and error probability for a fake server"""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    def should_fail(self):
+        return self.error_rate and random.random() < self.error_rate
+
+
+# ---------------- Supabase (PostgREST + Storage) ----------------
+class FakeSupabase:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0):
+        self.faults = Faults(latency, jitter, error_rate)
+        self.tables = {}  # table -> list of rows
+        self.objects = {}  # "bucket/path" -> bytes
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # ---- PostgREST ----
+    @staticmethod
+    def _matches(row, filters):
+        return all(str(row.get(column)) == value for column, value in filters.items())
+
+    def rest(self, method, table, params, body):
+        filters = {
+            k: v[3:] for k, v in params.items() if isinstance(v, str) and v.startswith("eq.")
+        }
+        with self.lock:
+            rows = self.tables.setdefault(table, [])
+            if method == "GET":
+                result = [dict(r) for r in rows if self._matches(r, filters)]
+                if "order" in params:
+                    column, _, direction = params["order"].partition(".")
+                    result.sort(key=lambda r: str(r.get(column)), reverse=direction == "desc")
+                offset = int(params.get("offset", 0))
+                limit = params.get("limit")
+                result = result[offset : offset + int(limit) if limit else None]
+                return 200, result
+            if method == "POST":
+                new_rows = body if isinstance(body, list) else [body]
+                for row in new_rows:
+                    row.setdefault("id", str(uuid.uuid4()))
+                    rows.append(dict(row))
+                return 201, new_rows
+            matched = [r for r in rows if self._matches(r, filters)]
+            if method == "PATCH":
+                for row in matched:
+                    row.update(body)
+                return 200, [dict(r) for r in matched]
+            if method == "DELETE":
+                self.tables[table] = [r for r in rows if not self._matches(r, filters)]
+                return 200, matched
+        return 405, {"message": "method not allowed"}
+
+    # ---- Storage ----
+    def storage(self, method, path, body, raw):
+        parts = path.split("/", 1)
+        with self.lock:
+            if method == "POST" and parts[0] == "sign" and "paths" in body:
+                bucket = parts[1]
+                signed = []
+                for prefix in body["paths"]:
+                    key = f"{bucket}/{prefix}"
+                    if key in self.objects:
+                        url, error = f"/object/sign/{key}?token=fake", None
+                    else:
+                        url, error = None, "Either the object does not exist or you do not have access to it"
+                    signed.append({"path": prefix, "signedURL": url, "error": error})
+                return 200, signed
+            if method == "POST" and parts[0] == "sign":
+                key = parts[1]
+                if key not in self.objects:
+                    return 400, {"error": "not_found", "message": "Object not found"}
+                return 200, {"signedURL": f"/object/sign/{key}?token=fake"}
+            if method == "POST":
+                self.objects[path] = raw
+                return 200, {"Key": path}
+            if method == "GET" and parts[0] == "sign":
+                key = parts[1].split("?", 1)[0]
+                if key not in self.objects:
+                    return 404, {"error": "not_found"}
+                return 200, self.objects[key]
+            if method == "DELETE":
+                bucket = parts[0]
+                removed = []
+                for prefix in body.get("prefixes", []):
+                    if self.objects.pop(f"{bucket}/{prefix}", None) is not None:
+                        removed.append({"name": prefix})
+                return 200, removed
+        return 405, {"message": "method not allowed"}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                url = urlsplit(self.path)
+                params = dict(parse_qsl(url.query))
+                raw = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+                body = None
+                if raw and "json" in self.headers.get("Content-Type", ""):
+                    body = json.loads(raw)
+
+                fake.faults.delay()
+                if fake.faults.should_fail():
+                    return self._send(503, {"message": "injected error"})
+
+                if url.path.startswith("/rest/v1/"):
+                    table = url.path[len("/rest/v1/") :]
+                    status, payload = fake.rest(self.command, table, params, body)
+                elif url.path.startswith("/storage/v1/object/"):
+                    path = url.path[len("/storage/v1/object/") :]
+                    status, payload = fake.storage(self.command, path, body or {}, raw)
+                else:
+                    status, payload = 404, {"message": "not found"}
+                self._send(status, payload)
+
+            def _send(self, status, payload):
+                if isinstance(payload, bytes):
+                    data, content_type = payload, "application/octet-stream"
+                else:
+                    data, content_type = json.dumps(payload).encode(), "application/json"
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = _handle
+
+        return Handler
+
+
+# ---------------- SMTP ----------------
+class FakeSMTP:
+    """Accepts mail without TLS or auth and keeps every message in memory"""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0):
+        self.faults = Faults(latency, jitter, error_rate)
+        self.messages = []  # (recipients, raw message)
+        self.lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def find_message(self, recipient):
+        """Latest message sent to recipient, or None"""
+        with self.lock:
+            for recipients, data in reversed(self.messages):
+                if recipient in recipients:
+                    return data
+        return None
+
+    def _handler(self):
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(f"{line}\r\n".encode())
+
+            def handle(self):
+                recipients = []
+                self.reply("220 fake-smtp ready")
+                while True:
+                    line = self.rfile.readline().decode(errors="replace").strip()
+                    if not line:
+                        return
+                    command = line[:4].upper()
+                    if command in ("EHLO", "HELO"):
+                        self.reply("250 fake-smtp")
+                    elif command == "MAIL":
+                        recipients = []
+                        self.reply("250 OK")
+                    elif command == "RCPT":
+                        recipients.append(line.split(":", 1)[1].strip(" <>"))
+                        self.reply("250 OK")
+                    elif command == "DATA":
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        lines = []
+                        while True:
+                            data_line = self.rfile.readline()
+                            if data_line in (b".\r\n", b".\n", b""):
+                                break
+                            lines.append(data_line)
+                        fake.faults.delay()
+                        if fake.faults.should_fail():
+                            self.reply("451 injected error")
+                            continue
+                        with fake.lock:
+                            fake.messages.append((recipients, b"".join(lines).decode(errors="replace")))
+                        self.reply("250 OK queued")
+                    elif command == "QUIT":
+                        self.reply("221 Bye")
+                        return
+                    else:  # RSET, NOOP, ...
+                        self.reply("250 OK")
+
+        return Handler
+
+
+# ---------------- Redis ----------------
+class FakeRedis:
+    """
+    RESP server with the commands RedisState sends (strings with expiry,
+    counters, sorted sets). Pipelined commands are answered in order.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0):
+        self.faults = Faults(latency, jitter, error_rate)
+        self.data = {}  # key -> bytes, or {member: score} for sorted sets
+        self.expires = {}  # key -> unix time
+        self.scans = {}  # SCAN cursor -> keys not yet returned
+        self.next_cursor = 0
+        self.commands = self.round_trips = 0
+        self.lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        return f"redis://127.0.0.1:{self.server.server_address[1]}/0"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _live(self, key):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def _set_expiry(self, key, ms):
+        self.expires[key] = time.time() + int(ms) / 1000
+
+    def execute(self, name, args):
+        """Run one command; returns the reply value (Exception for errors)"""
+        with self.lock:
+            self.commands += 1
+            if name in ("PING",):
+                return "PONG"
+            if name in ("SELECT", "AUTH"):
+                return "OK"
+            if name == "FLUSHDB":
+                self.data.clear()
+                self.expires.clear()
+                return "OK"
+            if name == "GET":
+                return self.data[args[0]] if self._live(args[0]) else None
+            if name == "MGET":
+                return [self.data[k] if self._live(k) else None for k in args]
+            if name == "SET":
+                key, value = args[0], args[1]
+                options = [a.upper() for a in args[2:]]
+                if b"NX" in options and self._live(key):
+                    return None
+                self.data[key] = value
+                self.expires.pop(key, None)
+                if b"PX" in options:
+                    self._set_expiry(key, args[2 + options.index(b"PX") + 1])
+                elif b"EX" in options:
+                    self._set_expiry(key, int(args[2 + options.index(b"EX") + 1]) * 1000)
+                return "OK"
+            if name == "DEL":
+                removed = 0
+                for key in args:
+                    if self._live(key):
+                        removed += 1
+                    self.data.pop(key, None)
+                    self.expires.pop(key, None)
+                return removed
+            if name == "INCRBY":
+                key = args[0]
+                value = (int(self.data[key]) if self._live(key) else 0) + int(args[1])
+                self.data[key] = str(value).encode()
+                return value
+            if name == "PEXPIRE":
+                if not self._live(args[0]):
+                    return 0
+                self._set_expiry(args[0], args[1])
+                return 1
+            if name == "PTTL":
+                if not self._live(args[0]):
+                    return -2
+                if args[0] not in self.expires:
+                    return -1
+                return int((self.expires[args[0]] - time.time()) * 1000)
+            if name == "SCAN":
+                # A cursor names a snapshot of the keys still to visit, so
+                # deleting keys mid-scan skips nothing (as in Redis)
+                options = {args[i].upper(): args[i + 1] for i in range(1, len(args) - 1, 2)}
+                pattern = options.get(b"MATCH", b"*").decode()
+                count = int(options.get(b"COUNT", 10))
+                cursor = int(args[0])
+                keys = self.scans.pop(cursor, None) if cursor else list(self.data)
+                batch, rest = (keys or [])[:count], (keys or [])[count:]
+                if rest:
+                    self.next_cursor += 1
+                    cursor = self.next_cursor
+                    self.scans[cursor] = rest
+                else:
+                    cursor = 0
+                matched = [
+                    k for k in batch if self._live(k) and fnmatch.fnmatchcase(k.decode(), pattern)
+                ]
+                return [str(cursor).encode(), matched]
+            if name == "ZADD":
+                zset = self.data.setdefault(args[0], {})
+                pairs = args[1:]
+                only_existing = pairs[0].upper() == b"XX"
+                if only_existing:
+                    pairs = pairs[1:]
+                added = 0
+                for score, member in zip(pairs[::2], pairs[1::2]):
+                    if only_existing and member not in zset:
+                        continue
+                    added += member not in zset
+                    zset[member] = float(score)
+                return added
+            if name == "ZREM":
+                zset = self.data.get(args[0], {})
+                return sum(zset.pop(member, None) is not None for member in args[1:])
+            if name == "ZRANGEBYSCORE":
+                zset = self.data.get(args[0], {})
+                low, high = float(args[1]), float(args[2])
+                members = sorted((s, m) for m, s in zset.items() if low <= s <= high)
+                result = [m for _, m in members]
+                if len(args) >= 6 and args[3].upper() == b"LIMIT":
+                    offset, count = int(args[4]), int(args[5])
+                    result = result[offset : offset + count if count >= 0 else None]
+                return result
+        return Exception(f"ERR unknown command '{name}'")
+
+    def _handler(self):
+        fake = self
+
+        def encode(reply):
+            if reply is None:
+                return b"$-1\r\n"
+            if isinstance(reply, Exception):
+                return f"-{reply}\r\n".encode()
+            if isinstance(reply, str):
+                return f"+{reply}\r\n".encode()
+            if isinstance(reply, int):
+                return f":{reply}\r\n".encode()
+            if isinstance(reply, bytes):
+                return f"${len(reply)}\r\n".encode() + reply + b"\r\n"
+            return f"*{len(reply)}\r\n".encode() + b"".join(encode(r) for r in reply)
+
+        def parse(buffer):
+            """Complete commands at the front of buffer, and the bytes consumed"""
+            commands, pos = [], 0
+            while True:
+                start, args = pos, []
+                try:
+                    end = buffer.index(b"\r\n", pos)
+                    count, pos = int(buffer[pos + 1 : end]), end + 2
+                    for _ in range(count):
+                        end = buffer.index(b"\r\n", pos)
+                        length, pos = int(buffer[pos + 1 : end]), end + 2
+                        if len(buffer) < pos + length + 2:
+                            raise ValueError
+                        args.append(bytes(buffer[pos : pos + length]))
+                        pos += length + 2
+                except ValueError:
+                    return commands, start
+                commands.append(args)
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                buffer = bytearray()
+                while True:
+                    data = self.request.recv(65536)
+                    if not data:
+                        return
+                    buffer += data
+                    commands, consumed = parse(buffer)
+                    del buffer[:consumed]
+                    if not commands:
+                        continue
+                    with fake.lock:
+                        fake.round_trips += 1
+                    fake.faults.delay()  # once per round trip, as on a network
+                    replies = []
+                    for args in commands:
+                        if fake.faults.should_fail():
+                            replies.append(Exception("ERR injected error"))
+                        else:
+                            replies.append(fake.execute(args[0].decode().upper(), args[1:]))
+                    self.request.sendall(b"".join(encode(r) for r in replies))
+
+        return Handler
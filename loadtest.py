@@ -0,0 +1,310 @@
+# loadtest.py
+"""
+End-to-end load test against local stand-ins for Supabase, SMTP and
+(optionally) Redis.
+
+Starts the fake PostgREST/storage and SMTP servers (fakes.py), points the
+app at them, serves it from a child process on a local port and runs
+virtual users through a scripted mix of signup, login, conversions and
+history on the synthetic PDFs from bench.py. Peak RSS is reported for the
+app process on its own, so it reads as the memory of one instance.
+
+    python loadtest.py --users 8 --duration 60
+    python loadtest.py --mix conversions --supabase-latency 0.05 --supabase-error-rate 0.01
+    python loadtest.py --state redis --redis-latency 0.001
+"""
+import os
+import re
+import sys
+import time
+import email
+import uuid
+import random
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from collections import defaultdict
+
+import httpx
+
+import bench
+from fakes import FakeSupabase, FakeSMTP, FakeRedis
+
+# Weights of each action a logged-in virtual user picks from
+MIXES = {
+    "default": {
+        "history": 4,
+        "merge": 2,
+        "split": 2,
+        "compress": 2,
+        "pdf_to_jpg": 1,
+        "pdf_to_word": 1,
+        "login": 1,
+    },
+    "conversions": {
+        "merge": 1,
+        "split": 1,
+        "compress": 1,
+        "pdf_to_jpg": 1,
+        "pdf_to_word": 1,
+    },
+    "auth": {"login": 3, "history": 1, "signup": 1},
+}
+
+
+# ---------------- Metrics ----------------
+class Metrics:
+    def __init__(self):
+        self.latencies = defaultdict(list)  # route -> seconds
+        self.errors = defaultdict(int)  # route -> count
+        self.lock = threading.Lock()
+
+    def record(self, route, seconds, ok):
+        with self.lock:
+            self.latencies[route].append(seconds)
+            if not ok:
+                self.errors[route] += 1
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, int(round(pct / 100 * len(values))) - 1))
+    return values[index]
+
+
+def report(metrics, elapsed, app_rss_mb):
+    total = sum(len(v) for v in metrics.latencies.values())
+    errors = sum(metrics.errors.values())
+    print(f"\nRequests: {total} in {elapsed:.1f}s -> {total / elapsed:.1f} req/s")
+    print(f"Errors: {errors} ({(errors / total * 100) if total else 0:.2f}%)")
+    print(f"Peak RSS app process: {app_rss_mb:.1f} MB")
+    print(f"Peak RSS harness (fakes + load generator): {bench.peak_rss_mb():.1f} MB\n")
+    print(f"{'route':<22}{'count':>7}{'err%':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for route in sorted(metrics.latencies):
+        values = sorted(metrics.latencies[route])
+        err_pct = metrics.errors[route] / len(values) * 100
+        p50, p95, p99 = (percentile(values, p) * 1000 for p in (50, 95, 99))
+        print(f"{route:<22}{len(values):>7}{err_pct:>7.1f}{p50:>9.0f}{p95:>9.0f}{p99:>9.0f}")
+
+
+# ---------------- Virtual user ----------------
+class VirtualUser:
+    def __init__(self, base_url, smtp, metrics, corpus, mix):
+        self.client = httpx.Client(base_url=base_url, timeout=300)
+        self.smtp = smtp
+        self.metrics = metrics
+        self.corpus = corpus
+        self.mix = mix
+        self.email = f"load-{uuid.uuid4().hex[:12]}@example.com"
+        self.password = "load-test-password"
+        self.headers = {}
+
+    def call(self, route, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = self.client.request(method, url, **kwargs)
+            ok = resp.status_code < 400
+        except httpx.HTTPError:
+            resp, ok = None, False
+        self.metrics.record(route, time.perf_counter() - start, ok)
+        return resp if ok else None
+
+    def signup(self):
+        self.email = f"load-{uuid.uuid4().hex[:12]}@example.com"
+        resp = self.call(
+            "POST /signup",
+            "POST",
+            "/signup",
+            json={"fullName": "Load Test", "email": self.email, "password": self.password},
+        )
+        if not resp:
+            return False
+        message = self.smtp.find_message(self.email)
+        if not message:
+            return False
+        body = email.message_from_string(message).get_payload(decode=True).decode()
+        verify_url = re.search(r"https?://\S+/verify-email/\S+", body).group(0)
+        return bool(self.call("GET /verify-email", "GET", verify_url))
+
+    def login(self):
+        resp = self.call(
+            "POST /login",
+            "POST",
+            "/login",
+            json={"email": self.email, "password": self.password},
+        )
+        if not resp:
+            return False
+        user = resp.json()
+        self.headers = {"Authorization": f"Bearer {user['token']}", "X-User-ID": str(user["id"])}
+        return True
+
+    def upload(self, route, url, files, data=None):
+        opened = [(field, (os.path.basename(p), open(p, "rb"), "application/pdf")) for field, p in files]
+        try:
+            return self.call(route, "POST", url, files=opened, data=data, headers=self.headers)
+        finally:
+            for _, (_, f, _) in opened:
+                f.close()
+
+    def act(self, action):
+        text, scan = self.corpus["text"], self.corpus["scan"]
+        if action == "history":
+            self.call("GET /conversions", "GET", "/conversions", headers=self.headers)
+        elif action == "login":
+            self.login()
+        elif action == "signup":
+            self.signup() and self.login()
+        elif action == "merge":
+            self.upload("POST /merge-pdf", "/merge-pdf", [("files", text), ("files", scan)])
+        elif action == "split":
+            self.upload(
+                "POST /split-pdf",
+                "/split-pdf",
+                [("file", text)],
+                {"splitType": "pages", "splitValue": "2"},
+            )
+        elif action == "compress":
+            self.upload(
+                "POST /compress-pdf",
+                "/compress-pdf",
+                [("file", scan)],
+                {"compressionLevel": "medium"},
+            )
+        elif action == "pdf_to_jpg":
+            self.upload("POST /pdf-to-jpg", "/pdf-to-jpg", [("file", scan)])
+        elif action == "pdf_to_word":
+            self.upload("POST /pdf-to-word", "/pdf-to-word", [("file", text)])
+
+    def run(self, deadline):
+        if not (self.signup() and self.login()):
+            return
+        actions, weights = zip(*self.mix.items())
+        while time.time() < deadline:
+            self.act(random.choices(actions, weights)[0])
+        self.client.close()
+
+
+# ---------------- Harness ----------------
+def serve_app(env, ports, stop, peak_rss):
+    """
+    Child process: serve the app until `stop` is set, then report its peak
+    RSS, so memory is measured for one app instance alone
+    """
+    os.environ.update(env)  # before app/database are imported, they read env at import
+    from werkzeug.serving import make_server
+    import app as app_module
+
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ports.put(server.server_port)
+    stop.wait()
+    server.shutdown()
+    peak_rss.put(bench.peak_rss_mb())
+
+
+class AppProcess:
+    """The app served from a spawned child process"""
+
+    def __init__(self, ctx, env):
+        self.stop_event = ctx.Event()
+        self.peak_rss = ctx.Queue()
+        ports = ctx.Queue()
+        self.process = ctx.Process(
+            target=serve_app, args=(env, ports, self.stop_event, self.peak_rss), daemon=True
+        )
+        self.process.start()
+        self.port = ports.get(timeout=120)
+
+    def stop(self):
+        """Shut the app down and return its peak RSS in MB"""
+        self.stop_event.set()
+        rss = self.peak_rss.get(timeout=60)
+        self.process.join(timeout=30)
+        return rss
+
+
+def start_stack(args):
+    """Start the fakes, configure the app against them and serve it in a child process"""
+    supabase = FakeSupabase(
+        args.supabase_latency, args.supabase_jitter, args.supabase_error_rate
+    ).start()
+    smtp = FakeSMTP(args.smtp_latency, args.smtp_jitter, args.smtp_error_rate).start()
+    redis = None
+    if args.state == "redis":
+        redis = FakeRedis(args.redis_latency).start()
+        state_url = redis.url
+    else:
+        state_url = f"sqlite:///{tempfile.mkdtemp()}/state.db"
+
+    env = {
+        "SUPABASE_URL": supabase.url,
+        "SUPABASE_KEY": "load-test-key",
+        "SECRET_KEY": "load-test-secret",
+        "MAIL_SERVER": "127.0.0.1",
+        "MAIL_PORT": str(smtp.port),
+        "MAIL_USE_TLS": "false",
+        "MAIL_USERNAME": "loadtest@example.com",
+        "MAIL_PASSWORD": "",
+        "RATELIMIT_ENABLED": "false",
+        "STATE_URL": state_url,
+    }
+    ctx = multiprocessing.get_context("spawn")
+    app_process = AppProcess(ctx, env)
+    return app_process, supabase, smtp, redis
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="default")
+    parser.add_argument("--pages", type=int, default=6, help="pages in synthetic PDFs")
+    parser.add_argument("--supabase-latency", type=float, default=0.02)
+    parser.add_argument("--supabase-jitter", type=float, default=0.01)
+    parser.add_argument("--supabase-error-rate", type=float, default=0.0)
+    parser.add_argument("--smtp-latency", type=float, default=0.05)
+    parser.add_argument("--smtp-jitter", type=float, default=0.02)
+    parser.add_argument("--smtp-error-rate", type=float, default=0.0)
+    parser.add_argument("--state", choices=["sqlite", "redis"], default="sqlite")
+    parser.add_argument("--redis-latency", type=float, default=0.001)
+    args = parser.parse_args()
+
+    corpus = {
+        "text": bench.make_text_pdf(args.pages),
+        "scan": bench.make_scan_pdf(args.pages, dpi=100),
+    }
+    app_process, supabase, smtp, redis = start_stack(args)
+    base_url = f"http://127.0.0.1:{app_process.port}"
+    print(f"App on {base_url}, Supabase fake on {supabase.url}, SMTP fake on :{smtp.port}")
+    print(f"{args.users} users, mix '{args.mix}', {args.duration:.0f}s")
+
+    metrics = Metrics()
+    deadline = time.time() + args.duration
+    start = time.time()
+    users = [
+        threading.Thread(
+            target=VirtualUser(base_url, smtp, metrics, corpus, MIXES[args.mix]).run,
+            args=(deadline,),
+        )
+        for _ in range(args.users)
+    ]
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    elapsed = time.time() - start
+
+    app_rss_mb = app_process.stop()
+    report(metrics, elapsed, app_rss_mb)
+    supabase.stop()
+    smtp.stop()
+    if redis:
+        redis.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+# preflight.py
+"""
+Cheap PDF inspection and cost prediction for each operation.
+
+inspect_pdf() only reads the document structure and text layer with fitz,
+nothing is rendered. estimate() applies a linear model per operation:
+
+    value = c0 + c_pages * pages + c_text_pages * text_pages + c_image_mb * image_mb
+
+for both the run time (seconds) and the output size (bytes). Coefficients
+come from `python bench.py --calibrate`, which writes COST_MODEL_PATH;
+DEFAULT_MODEL is the result of such a run on the reference container.
+"""
+import os
+import json
+import logging
+import fitz  # PyMuPDF
+
+COST_MODEL_PATH = os.getenv("COST_MODEL_PATH", "cost_model.json")
+INLINE_BUDGET_SECONDS = float(os.getenv("INLINE_BUDGET_SECONDS", 20))
+SCAN_TEXT_CHARS = 20  # fewer characters than this on an image page -> scanned page
+
+OPERATIONS = [
+    "merge",
+    "split",
+    "compress_low",
+    "compress_medium",
+    "compress_high",
+    "pdf_to_word",
+    "pdf_to_jpg",
+]
+
+# [c0, c_pages, c_text_pages, c_image_mb]
+DEFAULT_MODEL = {
+    "merge": {
+        "seconds": [0.003847, 0.000625, 0.005719, 0.057755],
+        "output_size": [246.1, 575.6, 8768.8, 1049403.6],
+    },
+    "split": {
+        "seconds": [0.000788, 0.00112, 0.003606, 0.011055],
+        "output_size": [0.0, 825.4, 3090.0, 24819.0],
+    },
+    "compress_low": {
+        "seconds": [0.0, 0.008414, 0.00923, 2.871202],
+        "output_size": [293.9, 1503459.1, 0.0, 0.0],
+    },
+    "compress_medium": {
+        "seconds": [0.0, 0.010814, 0.01669, 2.661812],
+        "output_size": [0.0, 2661.3, 75231.1, 136809.1],
+    },
+    "compress_high": {
+        "seconds": [0.0, 0.007163, 0.006865, 1.884107],
+        "output_size": [311.7, 2603.1, 2751.5, 0.0],
+    },
+    "pdf_to_word": {
+        "seconds": [0.048732, 0.0, 0.15404, 10.297177],
+        "output_size": [36943.7, 195.7, 0.0, 82043.9],
+    },
+    "pdf_to_jpg": {
+        "seconds": [0.0, 0.045301, 0.035546, 3.318407],
+        "output_size": [0.0, 9320.4, 114168.1, 202003.3],
+    },
+}
+
+_model = None
+
+
+def load_model():
+    """Calibrated model from COST_MODEL_PATH if present, else DEFAULT_MODEL"""
+    global _model
+    if _model is None:
+        _model = DEFAULT_MODEL
+        if os.path.exists(COST_MODEL_PATH):
+            try:
+                with open(COST_MODEL_PATH) as f:
+                    _model = {**DEFAULT_MODEL, **json.load(f)}
+            except (OSError, ValueError) as e:
+                logging.error(f"[PREFLIGHT] Could not load {COST_MODEL_PATH}: {e}")
+    return _model
+
+
+def features(stats):
+    """Model inputs for a document: [1, pages, text_pages, image_mb]"""
+    return [
+        1.0,
+        stats["pages"],
+        stats["pages"] * stats["text_coverage"],
+        stats["image_bytes"] / (1024 * 1024),
+    ]
+
+
+def inspect_pdf(path):
+    """
+    Describe a PDF without rendering it: page/image/font counts, total
+    (compressed) image bytes, text coverage and whether it looks scanned.
+    """
+    doc = fitz.open(path)
+    try:
+        stats = {
+            "pages": len(doc),
+            "file_size": os.path.getsize(path),
+            "encrypted": bool(doc.needs_pass),
+            "images": 0,
+            "image_bytes": 0,
+            "fonts": 0,
+            "text_coverage": 0.0,
+            "is_scan": False,
+        }
+        if doc.needs_pass or not len(doc):
+            return stats
+
+        image_xrefs, font_xrefs = set(), set()
+        text_pages = scan_pages = 0
+        for page in doc:
+            page_images = [img[0] for img in page.get_images(full=True)]
+            for xref in page_images:
+                if xref not in image_xrefs:
+                    image_xrefs.add(xref)
+                    length = doc.xref_get_key(xref, "Length")
+                    if length[0] == "int":
+                        stats["image_bytes"] += int(length[1])
+            font_xrefs.update(font[0] for font in page.get_fonts(full=True))
+
+            chars = len(page.get_text("text").strip())
+            if chars >= SCAN_TEXT_CHARS:
+                text_pages += 1
+            elif page_images:
+                scan_pages += 1
+
+        stats["images"] = len(image_xrefs)
+        stats["fonts"] = len(font_xrefs)
+        stats["text_coverage"] = round(text_pages / len(doc), 3)
+        stats["is_scan"] = scan_pages / len(doc) >= 0.5
+        return stats
+    finally:
+        doc.close()
+
+
+def estimate(stats, operation):
+    """Predicted seconds / output bytes for one operation on a document"""
+    coefficients = load_model()[operation]
+    x = features(stats)
+    seconds = max(0.0, sum(c * v for c, v in zip(coefficients["seconds"], x)))
+    output_size = max(0, int(sum(c * v for c, v in zip(coefficients["output_size"], x))))
+    result = {
+        "seconds": round(seconds, 3),
+        "output_size": output_size,
+        "execution": "queued" if should_queue(seconds) else "inline",
+    }
+    if operation.startswith("compress"):
+        result["shrinks"] = output_size < stats["file_size"]
+    return result
+
+
+def estimate_all(stats):
+    return {operation: estimate(stats, operation) for operation in OPERATIONS}
+
+
+def should_queue(seconds):
+    """Whether a job predicted to take `seconds` is too long to run inline"""
+    return seconds > INLINE_BUDGET_SECONDS
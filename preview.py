@@ -0,0 +1,244 @@
+# preview.py
+"""
+Page previews for the split / edit UIs.
+
+A document is uploaded once and stored under its SHA-256; pages are then
+rendered on demand at a requested width and format. Rendered images go
+through RenderCache: an in-memory LRU bounded by PREVIEW_MEMORY_MB whose
+evicted entries spill to a disk LRU bounded by PREVIEW_DISK_MB.
+
+Everything here is node-local: the workers of one node share the disk
+tier and the stored documents through the filesystem, but another node
+answers "Document not found" until the document is uploaded there.
+"""
+import os
+import re
+import uuid
+import hashlib
+import logging
+import threading
+from io import BytesIO
+from collections import OrderedDict
+import fitz  # PyMuPDF
+from PIL import Image
+
+PREVIEW_FOLDER = "previews"
+DOCS_FOLDER = os.path.join(PREVIEW_FOLDER, "docs")
+CACHE_FOLDER = os.path.join(PREVIEW_FOLDER, "cache")
+os.makedirs(DOCS_FOLDER, exist_ok=True)
+os.makedirs(CACHE_FOLDER, exist_ok=True)
+
+PREVIEW_MEMORY_MB = int(os.getenv("PREVIEW_MEMORY_MB", 64))
+PREVIEW_DISK_MB = int(os.getenv("PREVIEW_DISK_MB", 512))
+PREVIEW_DOCS_MB = int(os.getenv("PREVIEW_DOCS_MB", 1024))
+
+FORMATS = {"webp": "image/webp", "png": "image/png", "jpeg": "image/jpeg"}
+MIN_WIDTH, MAX_WIDTH = 16, 2000
+DEFAULT_WIDTH = 300
+QUALITY = 80
+HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class RenderCache:
+    """LRU of rendered pages: memory tier, spilling to a disk tier"""
+
+    def __init__(self, memory_bytes, disk_bytes, folder):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.folder = folder
+        self.entries = OrderedDict()  # key -> bytes, oldest first
+        self.size = 0
+        self.disk_size = sum(size for _, size, _ in self._disk_files())
+        self.lock = threading.Lock()
+        self.hits = self.disk_hits = self.misses = 0
+
+    def _disk_path(self, key):
+        return os.path.join(self.folder, key)
+
+    def _disk_files(self):
+        """(mtime, size, filename) of cached pages, skipping in-flight .tmp writes"""
+        files = []
+        for filename in os.listdir(self.folder):
+            if filename.endswith(".tmp"):
+                continue
+            try:
+                stat = os.stat(self._disk_path(filename))
+            except FileNotFoundError:  # trimmed by another worker
+                continue
+            files.append((stat.st_mtime, stat.st_size, filename))
+        return files
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return data
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                data = f.read()
+            os.utime(self._disk_path(key))  # mtime is the disk LRU clock
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.disk_hits += 1
+        self.put(key, data)
+        return data
+
+    def put(self, key, data):
+        """Add to memory; least recently used entries spill to disk"""
+        evicted = []
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.memory_bytes and len(self.entries) > 1:
+                old_key, old_data = self.entries.popitem(last=False)
+                self.size -= len(old_data)
+                evicted.append((old_key, old_data))
+        for old_key, old_data in evicted:
+            self._spill(old_key, old_data)
+
+    def _spill(self, key, data):
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            return
+        tmp_path = f"{path}.{uuid.uuid4()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.disk_size += len(data)
+            over = self.disk_size > self.disk_bytes
+        if over:
+            self._trim_disk()
+
+    def _trim_disk(self):
+        """Delete least recently used files until under 90% of the disk budget"""
+        files = sorted(self._disk_files())
+        total = sum(size for _, size, _ in files)
+        for _, size, filename in files:
+            if total <= self.disk_bytes * 0.9:
+                break
+            try:
+                os.remove(self._disk_path(filename))
+            except FileNotFoundError:
+                pass
+            total -= size
+        with self.lock:
+            self.disk_size = total
+
+
+cache = RenderCache(
+    PREVIEW_MEMORY_MB * 1024 * 1024, PREVIEW_DISK_MB * 1024 * 1024, CACHE_FOLDER
+)
+
+
+# ---------------- Documents ----------------
+def store_document(file):
+    """
+    Save an uploaded PDF under its SHA-256 (deduplicated).
+    Returns (doc_hash, page_count).
+    """
+    tmp_path = os.path.join(DOCS_FOLDER, f"{uuid.uuid4()}.tmp")
+    digest = hashlib.sha256()
+    with open(tmp_path, "wb") as f:
+        for chunk in iter(lambda: file.stream.read(1024 * 1024), b""):
+            digest.update(chunk)
+            f.write(chunk)
+    doc_hash = digest.hexdigest()
+    path = os.path.join(DOCS_FOLDER, f"{doc_hash}.pdf")
+
+    try:
+        with fitz.open(tmp_path) as doc:
+            page_count = len(doc)
+    except Exception:
+        os.remove(tmp_path)
+        raise ValueError("Invalid PDF file")
+
+    os.replace(tmp_path, path)
+    trim_documents()
+    return doc_hash, page_count
+
+
+def document_path(doc_hash):
+    """Stored PDF for a hash, or None if unknown / evicted"""
+    if not HASH_RE.match(doc_hash):
+        return None
+    path = os.path.join(DOCS_FOLDER, f"{doc_hash}.pdf")
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def trim_documents():
+    """Delete least recently previewed documents beyond PREVIEW_DOCS_MB"""
+    docs = []
+    for filename in os.listdir(DOCS_FOLDER):
+        if not filename.endswith(".pdf"):
+            continue
+        try:
+            stat = os.stat(os.path.join(DOCS_FOLDER, filename))
+        except FileNotFoundError:  # evicted by another worker
+            continue
+        docs.append((stat.st_mtime, stat.st_size, filename))
+    docs.sort()
+    total = sum(size for _, size, _ in docs)
+    for _, size, filename in docs:
+        if total <= PREVIEW_DOCS_MB * 1024 * 1024:
+            break
+        try:
+            os.remove(os.path.join(DOCS_FOLDER, filename))
+            logging.info(f"[CLEANUP] Evicted preview document {filename}")
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+# ---------------- Rendering ----------------
+def cache_key(doc_hash, page, width, fmt):
+    return f"{doc_hash}_{page}_{width}.{fmt}"
+
+
+def clamp_width(width):
+    return max(MIN_WIDTH, min(MAX_WIDTH, width))
+
+
+def render_page(path, page_number, width, fmt):
+    """Render one page (1-indexed) scaled to width pixels"""
+    with fitz.open(path) as doc:
+        if not 1 <= page_number <= len(doc):
+            raise IndexError(f"Page {page_number} out of range (1-{len(doc)})")
+        page = doc[page_number - 1]
+        scale = width / page.rect.width
+        pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+
+    if fmt == "png":
+        return pix.tobytes("png")
+    if fmt == "jpeg":
+        return pix.tobytes("jpeg", jpg_quality=QUALITY)
+    buffer = BytesIO()
+    Image.frombytes("RGB", (pix.width, pix.height), pix.samples).save(
+        buffer, "WEBP", quality=QUALITY
+    )
+    return buffer.getvalue()
+
+
+def get_preview(doc_hash, page_number, width, fmt):
+    """Cached page image bytes, or None if the document is unknown"""
+    key = cache_key(doc_hash, page_number, width, fmt)
+    data = cache.get(key)
+    if data is not None:
+        return data
+    path = document_path(doc_hash)
+    if not path:
+        return None
+    data = render_page(path, page_number, width, fmt)
+    cache.put(key, data)
+    return data
@@ -0,0 +1,504 @@
+# state.py
+"""
+Shared state for all worker processes: rate limits, caches and scheduled
+jobs live here instead of in one worker's memory.
+
+STATE_URL picks the backend:
+    sqlite:///state.db      single node, SQLite in WAL mode (default)
+    redis://host:6379/0     several nodes, anything speaking the Redis protocol
+
+Both backends expose the same small API, with batched forms (get_many,
+set_many, claim_due) so that a request costs one round trip to the store
+rather than one per key.
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import sqlite3
+import threading
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+from limits.storage import Storage
+
+load_dotenv()
+
+STATE_URL = os.getenv("STATE_URL", "sqlite:///state.db")
+SCHEDULER_INTERVAL = float(os.getenv("SCHEDULER_INTERVAL", 5))  # seconds
+SCHEDULER_RETRY_DELAY = float(os.getenv("SCHEDULER_RETRY_DELAY", 300))  # seconds
+# A claimed job is hidden this long; if its worker dies it becomes due again
+SCHEDULER_LEASE = float(os.getenv("SCHEDULER_LEASE", 300))  # seconds
+SCHEDULER_BATCH = 100
+
+
+# ---------------- SQLite backend ----------------
+class SQLiteState:
+    """Single-node backend: one SQLite file in WAL mode, one connection per thread"""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        with self.transaction() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS kv "
+                "(key TEXT PRIMARY KEY, value BLOB, expires_at REAL)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs "
+                "(id TEXT PRIMARY KEY, kind TEXT, payload TEXT, run_at REAL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_run_at ON jobs (run_at)")
+
+    @property
+    def db(self):
+        if getattr(self.local, "db", None) is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")  # readers don't block the writer
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return self.local.db
+
+    def transaction(self):
+        return _SQLiteTransaction(self.db)
+
+    def get(self, key):
+        return self.get_many([key])[key]
+
+    def get_many(self, keys):
+        """{key: value or None} in one query"""
+        result = dict.fromkeys(keys)
+        if keys:
+            rows = self.db.execute(
+                f"SELECT key, value FROM kv WHERE key IN ({','.join('?' * len(keys))}) "
+                "AND (expires_at IS NULL OR expires_at > ?)",
+                [*keys, time.time()],
+            )
+            result.update(rows)
+        return result
+
+    def set(self, key, value, ttl=None):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, mapping, ttl=None):
+        """Write several keys in one transaction"""
+        expires_at = time.time() + ttl if ttl else None
+        with self.transaction() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                [(key, value, expires_at) for key, value in mapping.items()],
+            )
+
+    def delete(self, key):
+        self.db.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def delete_prefix(self, prefix):
+        cursor = self.db.execute("DELETE FROM kv WHERE key LIKE ? || '%'", (prefix,))
+        return cursor.rowcount
+
+    def incr(self, key, amount=1, ttl=None):
+        """
+        Add amount to an integer counter and return the new value. The
+        expiry is set when the counter is created (fixed window).
+        """
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        row = self.db.execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "value = CASE WHEN kv.expires_at <= ? THEN excluded.value "
+            "ELSE CAST(kv.value AS INTEGER) + excluded.value END, "
+            "expires_at = CASE WHEN kv.expires_at <= ? THEN excluded.expires_at "
+            "ELSE kv.expires_at END "
+            "RETURNING value",
+            (key, amount, expires_at, now, now),
+        ).fetchone()
+        return int(row[0])
+
+    def ttl(self, key):
+        """Seconds until key expires, None if it has no expiry or is missing"""
+        row = self.db.execute(
+            "SELECT expires_at FROM kv WHERE key = ?", (key,)
+        ).fetchone()
+        if not row or row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def schedule(self, kind, payload, delay, job_id=None):
+        self.db.execute(
+            "INSERT OR REPLACE INTO jobs (id, kind, payload, run_at) VALUES (?, ?, ?, ?)",
+            (job_id or str(uuid.uuid4()), kind, json.dumps(payload), time.time() + delay),
+        )
+
+    def claim_due(self, limit=SCHEDULER_BATCH, lease=SCHEDULER_LEASE):
+        """
+        Atomically lease up to `limit` due jobs: [(job_id, kind, payload)].
+        A leased job stays stored until complete(); if that never comes it
+        is due again once the lease runs out.
+        """
+        now = time.time()
+        with self.transaction() as db:
+            rows = db.execute(
+                "SELECT id, kind, payload FROM jobs WHERE run_at <= ? ORDER BY run_at LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            db.executemany(
+                "UPDATE jobs SET run_at = ? WHERE id = ?", [(now + lease, row[0]) for row in rows]
+            )
+        return [(job_id, kind, json.loads(payload)) for job_id, kind, payload in rows]
+
+    def complete(self, job_id):
+        self.db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def purge_expired(self):
+        self.db.execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),))
+
+    def ping(self):
+        return self.db.execute("SELECT 1").fetchone() == (1,)
+
+
+class _SQLiteTransaction:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+# ---------------- Redis backend ----------------
+class RedisError(Exception):
+    """Error reply from the Redis server"""
+
+
+class RedisConnection:
+    """Minimal RESP client; pipeline() sends a batch of commands in one write"""
+
+    def __init__(self, host, port, db=0, password=None, timeout=5):
+        self.address = (host, port)
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.sock = None
+
+    def _connect(self):
+        self.sock = socket.create_connection(self.address, timeout=self.timeout)
+        self.reader = self.sock.makefile("rb")
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            self._send_and_read(setup)
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    @staticmethod
+    def _encode(args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(f"${len(arg)}\r\n".encode() + arg + b"\r\n")
+        return b"".join(parts)
+
+    def _read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b"+":
+            return rest.decode()
+        if prefix == b"-":
+            return RedisError(rest.decode())
+        if prefix == b":":
+            return int(rest)
+        if prefix == b"$":
+            length = int(rest)
+            if length == -1:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if prefix == b"*":
+            count = int(rest)
+            return None if count == -1 else [self._read_reply() for _ in range(count)]
+        raise RedisError(f"Unexpected reply {line!r}")
+
+    def _send_and_read(self, commands):
+        self.sock.sendall(b"".join(self._encode(args) for args in commands))
+        replies = [self._read_reply() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def pipeline(self, commands):
+        if not commands:
+            return []
+        if self.sock is None:
+            self._connect()
+        try:
+            return self._send_and_read(commands)
+        except (OSError, ConnectionError):
+            self.close()
+            raise
+
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+
+
+class RedisState:
+    """Multi-node backend over the Redis protocol, one connection per thread"""
+
+    JOBS_KEY = "jobs:due"
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 6379
+        self.db_index = int(parts.path.lstrip("/") or 0)
+        self.password = parts.password
+        self.local = threading.local()
+
+    @property
+    def conn(self):
+        if getattr(self.local, "conn", None) is None:
+            self.local.conn = RedisConnection(
+                self.host, self.port, self.db_index, self.password
+            )
+        return self.local.conn
+
+    def get(self, key):
+        return self.conn.execute("GET", key)
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        return dict(zip(keys, self.conn.execute("MGET", *keys)))
+
+    def set(self, key, value, ttl=None):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, mapping, ttl=None):
+        expiry = ["PX", int(ttl * 1000)] if ttl else []
+        self.conn.pipeline([("SET", key, value, *expiry) for key, value in mapping.items()])
+
+    def delete(self, key):
+        self.conn.execute("DEL", key)
+
+    def delete_prefix(self, prefix):
+        """Delete keys batch by batch with SCAN (KEYS would block the server)"""
+        cursor, deleted = b"0", 0
+        while True:
+            cursor, keys = self.conn.execute(
+                "SCAN", cursor, "MATCH", f"{prefix}*", "COUNT", 1000
+            )
+            if keys:
+                deleted += self.conn.execute("DEL", *keys)
+            if cursor == b"0":
+                return deleted
+
+    def incr(self, key, amount=1, ttl=None):
+        """
+        One round trip: SET NX creates a missing counter together with its
+        expiry (fixed window), so a counter never exists without one.
+        """
+        if not ttl:
+            return self.conn.execute("INCRBY", key, amount)
+        _, value = self.conn.pipeline(
+            [("SET", key, 0, "PX", int(ttl * 1000), "NX"), ("INCRBY", key, amount)]
+        )
+        return value
+
+    def ttl(self, key):
+        pttl = self.conn.execute("PTTL", key)
+        return None if pttl < 0 else pttl / 1000
+
+    def schedule(self, kind, payload, delay, job_id=None):
+        job_id = job_id or str(uuid.uuid4())
+        self.conn.pipeline(
+            [
+                ("SET", f"job:{job_id}", json.dumps({"kind": kind, "payload": payload})),
+                ("ZADD", self.JOBS_KEY, time.time() + delay, job_id),
+            ]
+        )
+
+    def claim_due(self, limit=SCHEDULER_BATCH, lease=SCHEDULER_LEASE):
+        """
+        Lease due jobs: whoever sets a job's lease key first owns it, so each
+        job runs once across all workers and nodes. Its score moves past the
+        lease; the job is only removed by complete(), otherwise it is due
+        again when the lease expires.
+        """
+        due = self.conn.execute(
+            "ZRANGEBYSCORE", self.JOBS_KEY, "-inf", time.time(), "LIMIT", 0, limit
+        )
+        if not due:
+            return []
+        job_ids = [job_id.decode() for job_id in due]
+        leased = self.conn.pipeline(
+            [("SET", f"lease:{job_id}", 1, "PX", int(lease * 1000), "NX") for job_id in job_ids]
+        )
+        job_ids = [job_id for job_id, ok in zip(job_ids, leased) if ok]
+        if not job_ids:
+            return []
+        run_at = time.time() + lease
+        keys = [f"job:{job_id}" for job_id in job_ids]
+        # XX: a job completed meanwhile is not put back
+        replies = self.conn.pipeline(
+            [("ZADD", self.JOBS_KEY, "XX", run_at, job_id) for job_id in job_ids]
+            + [("MGET", *keys)]
+        )
+        jobs = replies[-1]
+        result = []
+        for job_id, raw in zip(job_ids, jobs):
+            if raw is None:
+                self.complete(job_id)  # job data gone, drop it from the schedule
+                continue
+            job = json.loads(raw)
+            result.append((job_id, job["kind"], job["payload"]))
+        return result
+
+    def complete(self, job_id):
+        self.conn.pipeline([("ZREM", self.JOBS_KEY, job_id), ("DEL", f"job:{job_id}")])
+
+    def purge_expired(self):
+        pass  # Redis expires keys itself
+
+    def ping(self):
+        return self.conn.execute("PING") == "PONG"
+
+
+# ---------------- Backend selection ----------------
+_state = None
+_state_lock = threading.Lock()
+
+
+def connect(url):
+    if url.startswith("sqlite:///"):
+        return SQLiteState(url[len("sqlite:///") :])
+    if url.startswith("redis://"):
+        return RedisState(url)
+    raise ValueError(f"Unsupported STATE_URL {url}, use sqlite:/// or redis://")
+
+
+def get_state():
+    """Process-wide backend for STATE_URL"""
+    global _state
+    with _state_lock:
+        if _state is None:
+            _state = connect(STATE_URL)
+    return _state
+
+
+# ---------------- Scheduler ----------------
+_jobs = {}
+_scheduler_started = False
+
+
+def register_job(kind, handler):
+    """handler(payload) runs when a job of this kind is due"""
+    _jobs[kind] = handler
+
+
+def schedule(kind, payload, delay, job_id=None):
+    get_state().schedule(kind, payload, delay, job_id)
+
+
+def run_due_jobs():
+    """
+    Claim and run every due job; returns how many were claimed. A job is
+    removed once its handler succeeds; one whose handler fails (or is
+    missing) is rescheduled after SCHEDULER_RETRY_DELAY, and one whose
+    worker dies runs again after SCHEDULER_LEASE.
+    """
+    state = get_state()
+    count = 0
+    while True:
+        jobs = state.claim_due()
+        for job_id, kind, payload in jobs:
+            try:
+                handler = _jobs.get(kind)
+                if not handler:
+                    raise LookupError(f"No handler for job {kind}")
+                handler(payload)
+                state.complete(job_id)
+            except Exception as e:
+                logging.error(
+                    f"[SCHEDULER] {kind} failed, retrying in {SCHEDULER_RETRY_DELAY:.0f}s: {e}",
+                    exc_info=True,
+                )
+                state.schedule(kind, payload, SCHEDULER_RETRY_DELAY, job_id)
+        count += len(jobs)
+        if len(jobs) < SCHEDULER_BATCH:
+            return count
+
+
+def start_scheduler():
+    """Poll for due jobs on a daemon thread (once per process)"""
+    global _scheduler_started
+    if _scheduler_started:
+        return
+    _scheduler_started = True
+
+    def loop():
+        while True:
+            try:
+                run_due_jobs()
+                get_state().purge_expired()
+            except Exception as e:
+                logging.error(f"[SCHEDULER] {e}", exc_info=True)
+            time.sleep(SCHEDULER_INTERVAL)
+
+    threading.Thread(target=loop, name="state-scheduler", daemon=True).start()
+
+
+# ---------------- Rate limiter storage ----------------
+class SharedStateStorage(Storage):
+    """
+    flask-limiter storage on the shared backend (fixed-window strategy):
+    Limiter(storage_uri="sharedstate://")
+    """
+
+    STORAGE_SCHEME = ["sharedstate"]
+    PREFIX = "limit:"
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def state(self):
+        return get_state()  # connect on first use, not when the app is built
+
+    @property
+    def base_exceptions(self):
+        return (sqlite3.Error, RedisError, OSError)
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        return self.state.incr(self.PREFIX + key, amount, expiry)
+
+    def get(self, key):
+        return int(self.state.get(self.PREFIX + key) or 0)
+
+    def get_expiry(self, key):
+        return time.time() + (self.state.ttl(self.PREFIX + key) or 0)
+
+    def check(self):
+        try:
+            return self.state.ping()
+        except Exception:
+            return False
+
+    def reset(self):
+        return self.state.delete_prefix(self.PREFIX)
+
+    def clear(self, key):
+        self.state.delete(self.PREFIX + key)
@@ -0,0 +1,249 @@
+# supabase_http.py
+"""
+Async Supabase client (PostgREST + Storage) on a pooled httpx connection.
+
+All calls are coroutines so independent requests can run concurrently with
+asyncio.gather. Flask routes are synchronous, so `run()` executes a
+coroutine on one long-lived background event loop, which also keeps the
+connection pool (keep-alive, HTTP/2 when `h2` is installed) warm across
+requests.
+"""
+import os
+import asyncio
+import random
+import logging
+import threading
+import httpx
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.getenv("SUPABASE_READ_TIMEOUT", 15))
+UPLOAD_TIMEOUT = float(os.getenv("SUPABASE_UPLOAD_TIMEOUT", 120))
+MAX_RETRIES = int(os.getenv("SUPABASE_MAX_RETRIES", 3))
+MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", 20))
+RETRY_BASE_DELAY = 0.2  # seconds, doubled per attempt before jitter
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# Request never reached the server, safe to retry even for writes
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class SupabaseError(Exception):
+    """Non-2xx response from PostgREST or Storage"""
+
+    def __init__(self, status_code, message):
+        super().__init__(f"{status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+
+
+def timeout(read=READ_TIMEOUT, connect=CONNECT_TIMEOUT):
+    """Build an httpx timeout with explicit connect/read limits"""
+    return httpx.Timeout(read, connect=connect, read=read, write=read, pool=connect)
+
+
+class FileStream:
+    """
+    Upload body read from disk in chunks. Every send re-reads the file from
+    the start, so retried uploads never need the whole file in memory.
+    """
+
+    def __init__(self, path, chunk_size=1024 * 1024):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.chunk_size = chunk_size
+
+    async def __aiter__(self):
+        with open(self.path, "rb") as f:
+            while chunk := await asyncio.to_thread(f.read, self.chunk_size):
+                yield chunk
+
+
+class SupabaseClient:
+    def __init__(self, url, key, http2=HTTP2_AVAILABLE, transport=None):
+        self.url = (url or "").rstrip("/")
+        self.key = key
+        self.http2 = http2
+        self.transport = transport  # e.g. httpx.MockTransport in tests
+        self._client = None
+
+    @property
+    def client(self):
+        """Pooled AsyncClient, created lazily on the loop that first uses it"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.url,
+                headers={"apikey": self.key, "Authorization": f"Bearer {self.key}"},
+                http2=self.http2,
+                timeout=timeout(),
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_CONNECTIONS,
+                    keepalive_expiry=30,
+                ),
+                transport=self.transport,
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(self, method, path, idempotent=None, **kwargs):
+        """
+        Send a request, retrying with jittered exponential backoff.
+        Idempotent calls are retried on timeouts and 5xx/429; other calls
+        only when the request was never sent.
+        """
+        if idempotent is None:
+            idempotent = method in ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+
+        for attempt in range(MAX_RETRIES + 1):
+            last_try = attempt == MAX_RETRIES
+            try:
+                resp = await self.client.request(method, path, **kwargs)
+            except NOT_SENT_ERRORS:
+                if last_try:
+                    raise
+            except httpx.TransportError:
+                if last_try or not idempotent:
+                    raise
+            else:
+                if resp.status_code < 400:
+                    return resp
+                if last_try or not idempotent or resp.status_code not in RETRYABLE_STATUS:
+                    raise SupabaseError(resp.status_code, resp.text)
+
+            delay = random.uniform(0, RETRY_BASE_DELAY * 2**attempt)
+            logging.warning(
+                f"[SUPABASE] {method} {path} failed (attempt {attempt + 1}), "
+                f"retrying in {delay:.2f}s"
+            )
+            await asyncio.sleep(delay)
+
+    # ---------------- PostgREST ----------------
+    @staticmethod
+    def _filters(filters):
+        return {column: f"eq.{value}" for column, value in (filters or {}).items()}
+
+    async def select(
+        self, table, filters=None, columns="*", order=None, desc=False, limit=None, offset=None
+    ):
+        params = {"select": columns, **self._filters(filters)}
+        if order:
+            params["order"] = f"{order}.{'desc' if desc else 'asc'}"
+        if limit is not None:
+            params["limit"] = limit
+        if offset:
+            params["offset"] = offset
+        resp = await self.request("GET", f"/rest/v1/{table}", params=params)
+        return resp.json()
+
+    async def insert(self, table, rows):
+        resp = await self.request(
+            "POST",
+            f"/rest/v1/{table}",
+            json=rows,
+            headers={"Prefer": "return=representation"},
+        )
+        return resp.json()
+
+    async def update(self, table, values, filters):
+        resp = await self.request(
+            "PATCH",
+            f"/rest/v1/{table}",
+            params=self._filters(filters),
+            json=values,
+            headers={"Prefer": "return=representation"},
+            idempotent=True,
+        )
+        return resp.json()
+
+    async def delete(self, table, filters):
+        resp = await self.request(
+            "DELETE",
+            f"/rest/v1/{table}",
+            params=self._filters(filters),
+            headers={"Prefer": "return=representation"},
+        )
+        return resp.json()
+
+    # ---------------- Storage ----------------
+    async def upload(self, bucket, path, content, content_type):
+        """
+        Upload bytes or a FileStream, overwriting any previous object (so
+        safe to retry)
+        """
+        headers = {"Content-Type": content_type, "x-upsert": "true"}
+        if isinstance(content, FileStream):
+            headers["Content-Length"] = str(content.size)  # instead of chunked
+        await self.request(
+            "POST",
+            f"/storage/v1/object/{bucket}/{path}",
+            content=content,
+            headers=headers,
+            timeout=timeout(read=UPLOAD_TIMEOUT),
+            idempotent=True,
+        )
+        return path
+
+    async def create_signed_url(self, bucket, path, expires_in):
+        resp = await self.request(
+            "POST",
+            f"/storage/v1/object/sign/{bucket}/{path}",
+            json={"expiresIn": expires_in},
+            idempotent=True,
+        )
+        return f"{self.url}/storage/v1{resp.json()['signedURL']}"
+
+    async def create_signed_urls(self, bucket, paths, expires_in):
+        """Sign many objects in one call. Returns {path: url or None if missing}"""
+        resp = await self.request(
+            "POST",
+            f"/storage/v1/object/sign/{bucket}",
+            json={"expiresIn": expires_in, "paths": paths},
+            idempotent=True,
+        )
+        return {
+            item["path"]: (
+                f"{self.url}/storage/v1{item['signedURL']}"
+                if item.get("signedURL") and not item.get("error")
+                else None
+            )
+            for item in resp.json()
+        }
+
+    async def remove(self, bucket, paths):
+        resp = await self.request(
+            "DELETE", f"/storage/v1/object/{bucket}", json={"prefixes": paths}
+        )
+        return resp.json()
+
+
+# ---------------- Sync bridge ----------------
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_loop():
+    """Background event loop shared by every sync caller in this process"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="supabase-loop", daemon=True
+            ).start()
+    return _loop
+
+
+def run(coro):
+    """Run a coroutine on the background loop and wait for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
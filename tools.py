@@ -1,7 +1,14 @@
 # tools.py
 import os
+import gc
 import uuid
 import shutil
+import time
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import fitz  # PyMuPDF
 from PyPDF2 import PdfMerger, PdfReader, PdfWriter
 from pdf2docx import Converter
@@ -10,28 +17,103 @@ from io import BytesIO
 UPLOAD_FOLDER = "uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Finished results kept on local disk for direct download
+RESULTS_FOLDER = "results"
+os.makedirs(RESULTS_FOLDER, exist_ok=True)
+RESULT_TTL_SECONDS = int(os.getenv("RESULT_TTL_SECONDS", 3600))
+RESULTS_MAX_MB = int(os.getenv("RESULTS_MAX_MB", 2048))
 
-def save_uploaded_files(files):
+# Uploads removed by their own route (streaming responses, /inspect); kept
+# out of UPLOAD_FOLDER, which the conversion routes wipe after every request
+STREAM_FOLDER = "streams"
+os.makedirs(STREAM_FOLDER, exist_ok=True)
+
+# Memory guard for rasterizing operations (compress, pdf -> jpg)
+MAX_RSS_MB = int(os.getenv("MAX_RSS_MB", 1024))
+MIN_RENDER_SCALE = 0.25
+FLUSH_EVERY_PAGES = int(os.getenv("FLUSH_EVERY_PAGES", 50))
+
+
+class MemoryLimitError(Exception):
+    """Raised when a rasterizing operation cannot stay under MAX_RSS_MB"""
+
+
+def current_rss_mb():
+    """Current resident set size of this process in MB (0 if unknown)"""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def check_memory(scale, page_number, full_scale):
+    """
+    Check RSS before rendering a page.
+    Halves the render scale while over MAX_RSS_MB and goes back to
+    full_scale once under it again; raises MemoryLimitError once the scale
+    cannot go lower.
+    """
+    rss = current_rss_mb()
+    if rss <= MAX_RSS_MB:
+        if scale != full_scale:
+            logging.info(
+                f"[MEMORY] RSS back to {rss:.0f}MB on page {page_number}, "
+                f"restoring render scale {full_scale}"
+            )
+        return full_scale
+    gc.collect()
+    if scale / 2 < MIN_RENDER_SCALE:
+        raise MemoryLimitError(
+            f"Memory limit reached ({rss:.0f}MB > {MAX_RSS_MB}MB) on page {page_number}"
+        )
+    logging.warning(
+        f"[MEMORY] RSS {rss:.0f}MB over {MAX_RSS_MB}MB on page {page_number}, "
+        f"lowering render scale to {scale / 2}"
+    )
+    return scale / 2
+
+
+def flush_pdf(doc, output_path, deflate=False):
+    """
+    Write pages built so far to output_path and reopen it, so that already
+    written pages are no longer held in memory.
+    """
+    if doc.name:
+        doc.save(
+            output_path,
+            incremental=True,
+            encryption=fitz.PDF_ENCRYPT_KEEP,
+            deflate=deflate,
+        )
+    else:
+        doc.save(output_path, deflate=deflate)
+    doc.close()
+    return fitz.open(output_path)
+
+
+def save_uploaded_files(files, folder=UPLOAD_FOLDER):
     paths = []
     for file in files:
         filename = f"{uuid.uuid4()}_{file.filename}"
-        path = os.path.join(UPLOAD_FOLDER, filename)
+        path = os.path.join(folder, filename)
         file.save(path)
         paths.append(path)
     return paths
 
 
-def merge_pdfs(paths):
+def merge_pdfs(paths, optimize=None):
     merger = PdfMerger()
     for pdf in paths:
         merger.append(pdf)
     output_path = os.path.join(UPLOAD_FOLDER, f"merged_{uuid.uuid4()}.pdf")
     merger.write(output_path)
     merger.close()
-    return output_path
+    return finalize_pdf(output_path, optimize)
 
 
-def split_pdf(path, split_type="pages", split_value=None):
+def split_pdf(path, split_type="pages", split_value=None, optimize=None):
     """
     Split a PDF into multiple files by pages or ranges and return a zip path.
 
@@ -39,6 +121,7 @@ def split_pdf(path, split_type="pages", split_value=None):
     split_value:
         - "pages": string with number of pages per split, e.g., "3"
         - "ranges": string with comma-separated ranges, e.g., "1-2,4-7"
+    optimize: output optimization applied to every part, see parse_optimize
     """
     reader = PdfReader(path)
     num_pages = len(reader.pages)
@@ -59,7 +142,7 @@ def split_pdf(path, split_type="pages", split_value=None):
             part_path = os.path.join(output_dir, f"pages_{start+1}_to_{end}.pdf")
             with open(part_path, "wb") as f:
                 writer.write(f)
-            files_created.append(part_path)
+            files_created.append(finalize_pdf(part_path, optimize))
 
     elif split_type == "ranges":
         if not split_value:
@@ -75,7 +158,7 @@ def split_pdf(path, split_type="pages", split_value=None):
             part_path = os.path.join(output_dir, f"pages_{start+1}_to_{end}.pdf")
             with open(part_path, "wb") as f:
                 writer.write(f)
-            files_created.append(part_path)
+            files_created.append(finalize_pdf(part_path, optimize))
 
     else:
         raise ValueError("Invalid split_type, must be 'pages' or 'ranges'")
@@ -84,10 +167,11 @@ def split_pdf(path, split_type="pages", split_value=None):
     return zip_path
 
 
-def compress_pdf(path, level="medium"):
+def compress_pdf(path, level="medium", optimize=None):
     """
     Compress a PDF according to the specified level.
     level: 'low', 'medium', 'high'
+    optimize: output optimization, see parse_optimize
     """
     doc = fitz.open(path)
     output_path = os.path.join(UPLOAD_FOLDER, f"compressed_{uuid.uuid4()}.pdf")
@@ -103,18 +187,93 @@ def compress_pdf(path, level="medium"):
         scale = 0.5
         deflate = True
 
-    # Create a new PDF with scaled pages
+    # Build the new PDF page by page, releasing each pixmap right away and
+    # flushing written pages to disk every FLUSH_EVERY_PAGES pages.
+    # Page geometry always follows the level's scale; under memory pressure
+    # only the image resolution drops.
+    level_scale = scale
     new_doc = fitz.open()
-    for page in doc:
-        mat = fitz.Matrix(scale, scale)
-        pix = page.get_pixmap(matrix=mat)
-        new_page = new_doc.new_page(width=pix.width, height=pix.height)
-        new_page.insert_image(new_page.rect, pixmap=pix)
+    try:
+        for i, page in enumerate(doc):
+            scale = check_memory(scale, i + 1, level_scale)
+            mat = fitz.Matrix(scale, scale)
+            pix = page.get_pixmap(matrix=mat)
+            new_page = new_doc.new_page(
+                width=page.rect.width * level_scale, height=page.rect.height * level_scale
+            )
+            new_page.insert_image(new_page.rect, pixmap=pix)
+            pix = None
+            fitz.TOOLS.store_shrink(100)  # drop MuPDF's cached decoded images
+            if (i + 1) % FLUSH_EVERY_PAGES == 0:
+                new_doc = flush_pdf(new_doc, output_path, deflate)
 
-    new_doc.save(output_path, deflate=deflate)
-    doc.close()
-    new_doc.close()
-    return output_path
+        new_doc = flush_pdf(new_doc, output_path, deflate)
+    finally:
+        # Also on MemoryLimitError: new_doc holds every page not yet flushed
+        doc.close()
+        new_doc.close()
+    return finalize_pdf(output_path, optimize)
+
+
+# ---------------- Output finalization ----------------
+OPTIMIZE_FLAGS = ["linearize", "objstms", "garbage", "compress"]
+OPTIMIZE_PRESETS = {
+    "web": ["linearize", "garbage"],  # page 1 viewable before full download
+    "compact": ["objstms", "garbage", "compress"],  # smallest file
+}
+
+
+def parse_optimize(optimize):
+    """
+    Turn an optimize= request value into fitz save options.
+
+    optimize: None / "none" (plain save), a preset ("web", "compact") or a
+    comma-separated list of flags: linearize, objstms, garbage, compress
+    """
+    if not optimize or optimize == "none":
+        return {}
+    flags = OPTIMIZE_PRESETS.get(optimize) or [f.strip() for f in optimize.split(",")]
+    unknown = [f for f in flags if f not in OPTIMIZE_FLAGS]
+    if unknown:
+        raise ValueError(
+            f"Invalid optimize option {', '.join(unknown)}, must be one of "
+            f"{', '.join(list(OPTIMIZE_PRESETS) + OPTIMIZE_FLAGS)}"
+        )
+    if "linearize" in flags and "objstms" in flags:
+        raise ValueError("Invalid optimize, 'linearize' and 'objstms' cannot be combined")
+
+    options = {}
+    if "linearize" in flags:
+        options["linear"] = True
+    if "objstms" in flags:
+        options["use_objstms"] = 1
+    if "garbage" in flags:
+        options["garbage"] = 3  # drop unused objects, merge duplicates
+    if "compress" in flags:
+        options.update(deflate=True, deflate_images=True, deflate_fonts=True)
+    return options
+
+
+def save_pdf(doc, output_path, optimize=None):
+    """Save an open fitz document with the requested optimize options"""
+    doc.save(output_path, **parse_optimize(optimize))
+
+
+def finalize_pdf(path, optimize=None):
+    """
+    Shared last stage of every PDF-producing tool: rewrite the output in
+    place with the requested optimize options. Returns path.
+    """
+    if not parse_optimize(optimize):
+        return path
+    tmp_path = f"{path}.{uuid.uuid4()}.tmp"
+    doc = fitz.open(path)
+    try:
+        save_pdf(doc, tmp_path, optimize)
+    finally:
+        doc.close()
+    os.replace(tmp_path, path)
+    return path
 
 
 def pdf_to_word(path):
@@ -125,19 +284,132 @@ def pdf_to_word(path):
     return output_path
 
 
-def pdf_to_jpg(path):
+def pdf_to_jpg(path, scale=1.0):
+    full_scale = scale
     pdf = fitz.open(path)
     output_dir = os.path.join(UPLOAD_FOLDER, f"jpg_{uuid.uuid4()}")
     os.makedirs(output_dir, exist_ok=True)
-    for i, page in enumerate(pdf):
-        pix = page.get_pixmap()
-        img_path = os.path.join(output_dir, f"page_{i+1}.jpg")
-        pix.save(img_path)
-    pdf.close()
+    try:
+        for i, page in enumerate(pdf):
+            scale = check_memory(scale, i + 1, full_scale)
+            pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale))
+            img_path = os.path.join(output_dir, f"page_{i+1}.jpg")
+            pix.save(img_path)
+            pix = None
+            fitz.TOOLS.store_shrink(100)  # drop MuPDF's cached decoded images
+    finally:
+        pdf.close()
     zip_path = shutil.make_archive(output_dir, "zip", output_dir)
     return zip_path
 
 
+# ---------------- Text extraction ----------------
+TEXT_MODES = ["plain", "blocks", "words", "html"]
+TEXT_PARALLEL_MIN_PAGES = int(os.getenv("TEXT_PARALLEL_MIN_PAGES", 32))
+TEXT_WORKERS = int(os.getenv("TEXT_WORKERS", os.cpu_count() or 1))
+TEXT_CHUNK_PAGES = 8  # pages per worker task
+
+_text_executor = None
+_text_executor_lock = threading.Lock()
+
+
+def extract_page_text(page, mode="plain"):
+    """Text of one fitz page as a JSON-ready dict, per TEXT_MODES"""
+    if mode == "plain":
+        return {"text": page.get_text("text")}
+    if mode == "blocks":
+        return {
+            "blocks": [
+                {
+                    "bbox": [x0, y0, x1, y1],
+                    "text": text,
+                    "type": "image" if block_type else "text",
+                }
+                for x0, y0, x1, y1, text, _, block_type in page.get_text("blocks")
+            ]
+        }
+    if mode == "words":
+        return {
+            "words": [
+                {"bbox": [x0, y0, x1, y1], "text": text, "block": block, "line": line}
+                for x0, y0, x1, y1, text, block, line, _ in page.get_text("words")
+            ]
+        }
+    if mode == "html":
+        return {"html": page.get_text("html")}
+    raise ValueError(f"Invalid mode, must be one of {', '.join(TEXT_MODES)}")
+
+
+def extract_text_chunk(path, mode, start, end):
+    """Worker task: extract pages [start, end) of a PDF"""
+    doc = fitz.open(path)
+    try:
+        return [{"page": i + 1, **extract_page_text(doc[i], mode)} for i in range(start, end)]
+    finally:
+        doc.close()
+
+
+def get_text_executor():
+    global _text_executor
+    with _text_executor_lock:
+        if _text_executor is None:
+            # spawn: forking a threaded server process is not safe
+            _text_executor = ProcessPoolExecutor(
+                max_workers=TEXT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+    return _text_executor
+
+
+def count_pages(path):
+    with fitz.open(path) as doc:
+        return len(doc)
+
+
+def extract_text_pages(path, mode="plain"):
+    """
+    Yield one dict per page, in page order.
+
+    Small documents are read page by page in this process. From
+    TEXT_PARALLEL_MIN_PAGES pages on, chunks of TEXT_CHUNK_PAGES pages go to
+    a process pool with at most 2 chunks per worker in flight, so memory
+    stays bounded whatever the page count.
+    """
+    if mode not in TEXT_MODES:
+        raise ValueError(f"Invalid mode, must be one of {', '.join(TEXT_MODES)}")
+
+    doc = fitz.open(path)
+    page_count = len(doc)
+    if page_count < TEXT_PARALLEL_MIN_PAGES or TEXT_WORKERS < 2:
+        try:
+            for i in range(page_count):
+                yield {"page": i + 1, **extract_page_text(doc[i], mode)}
+        finally:
+            doc.close()
+        return
+    doc.close()
+
+    executor = get_text_executor()
+    chunks = iter(range(0, page_count, TEXT_CHUNK_PAGES))
+    pending = deque()
+
+    def submit_next():
+        start = next(chunks, None)
+        if start is not None:
+            end = min(start + TEXT_CHUNK_PAGES, page_count)
+            pending.append(executor.submit(extract_text_chunk, path, mode, start, end))
+
+    try:
+        for _ in range(TEXT_WORKERS * 2):
+            submit_next()
+        while pending:
+            pages = pending.popleft().result()
+            submit_next()
+            yield from pages
+    finally:
+        for future in pending:  # client went away
+            future.cancel()
+
+
 def clear_uploads_folder(folder_path="uploads"):
     """
     Delete all files in the specified folder.
@@ -158,7 +430,67 @@ def clear_uploads_folder(folder_path="uploads"):
         except Exception as e:
             print(f"Failed to delete {file_path}: {e}")
 
-def edit_pdf(path, edit_type, content, x, y, page_number=1):
+def keep_result(file_path, conversion_id):
+    """
+    Move a finished result into RESULTS_FOLDER, named by its conversion id,
+    so it can be served directly until evicted.
+    """
+    ext = os.path.splitext(file_path)[1]
+    result_path = os.path.join(RESULTS_FOLDER, f"{conversion_id}{ext}")
+    shutil.move(file_path, result_path)
+    evict_results()
+    return result_path
+
+
+def get_result_path(conversion_id):
+    """
+    Return the absolute local result path for a conversion (send_file
+    resolves relative paths against the app root, not the working
+    directory), or None if evicted / expired
+    """
+    for filename in os.listdir(RESULTS_FOLDER):
+        if os.path.splitext(filename)[0] == str(conversion_id):
+            file_path = os.path.abspath(os.path.join(RESULTS_FOLDER, filename))
+            try:
+                if time.time() - os.path.getmtime(file_path) < RESULT_TTL_SECONDS:
+                    return file_path
+                os.remove(file_path)
+                logging.info(f"[CLEANUP] Evicted local result {file_path}")
+            except FileNotFoundError:
+                pass
+            return None
+    return None
+
+
+def evict_results():
+    """
+    Delete results older than RESULT_TTL_SECONDS, then the oldest ones
+    until the folder is under RESULTS_MAX_MB.
+    """
+    now = time.time()
+    entries = []
+    for filename in os.listdir(RESULTS_FOLDER):
+        file_path = os.path.join(RESULTS_FOLDER, filename)
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, file_path))
+
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, file_path in entries:
+        if now - mtime < RESULT_TTL_SECONDS and total <= RESULTS_MAX_MB * 1024 * 1024:
+            break
+        try:
+            os.remove(file_path)
+            logging.info(f"[CLEANUP] Evicted local result {file_path}")
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def edit_pdf(path, edit_type, content, x, y, page_number=1, optimize=None):
     """
     Edit a PDF by adding text, signature, or annotation.
 
@@ -167,6 +499,7 @@ def edit_pdf(path, edit_type, content, x, y, page_number=1):
     content: str - text or image path for signature
     x, y: int - coordinates for the edit
     page_number: int - 1-indexed page to edit (default: 1)
+    optimize: str - output optimization, see parse_optimize
     """
     doc = fitz.open(path)
     output_path = os.path.join(UPLOAD_FOLDER, f"edited_{uuid.uuid4()}.pdf")
@@ -190,6 +523,8 @@ def edit_pdf(path, edit_type, content, x, y, page_number=1):
         doc.close()
         raise ValueError("Invalid edit_type, must be 'add-text', 'add-signature', or 'add-annotation'")
 
-    doc.save(output_path)
-    doc.close()
+    try:
+        save_pdf(doc, output_path, optimize)
+    finally:
+        doc.close()
     return output_path
\ No newline at end of file